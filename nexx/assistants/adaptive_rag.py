@@ -33,7 +33,8 @@ from typing import Literal
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
+
+from nexx.assistants import registry
 
 
 # Data model
@@ -47,7 +48,7 @@ class RouteQuery(BaseModel):
 
 
 # LLM with function call
-llm = ChatOpenAI(model="gpt4", temperature=0)
+llm = registry.chat_openai(model="gpt4", temperature=0)
 structured_llm_router = llm.with_structured_output(RouteQuery)
 
 # Prompt
@@ -83,7 +84,7 @@ class GradeDocuments(BaseModel):
 
 
 # LLM with functional call
-llm = ChatOpenAI(model="gpt4", temperature=0)
+llm = registry.chat_openai(model="gpt4", temperature=0)
 structured_llm_grader = llm.with_structured_output(GradeDocuments)
 
 # Prompt
@@ -99,6 +100,12 @@ grade_prompt = ChatPromptTemplate.from_messages(
 )
 
 retrieval_grader = grade_prompt | structured_llm_grader
+
+from nexx.assistants.grading import listwise_grader
+
+# Grades all retrieved documents of a question in one call, see GRADER_MODE
+listwise_retrieval_grader = listwise_grader(llm)
+
 question = "agent memory"
 docs = retriever.get_relevant_documents(question)
 doc_txt = docs[1].page_content
@@ -107,14 +114,15 @@ print(retrieval_grader.invoke({"question": question, "document": doc_txt}))
 
 ### Generate
 
-from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
 
+from nexx.prompts import hub_cache
+
 # Prompt
-prompt = hub.pull("rlm/rag-prompt")
+prompt = hub_cache.pull("rlm/rag-prompt")
 
 # LLM
-llm = ChatOpenAI(model="gpt4", temperature=0)
+llm = registry.chat_openai(model="gpt4", temperature=0)
 
 
 # Post-processing
@@ -143,7 +151,7 @@ class GradeHallucinations(BaseModel):
 
 
 # LLM with function call
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+llm = registry.chat_openai(model="gpt-3.5-turbo-0125", temperature=0)
 structured_llm_grader = llm.with_structured_output(GradeHallucinations)
 
 # Prompt
@@ -173,7 +181,7 @@ class GradeAnswer(BaseModel):
 
 
 # LLM with function call
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+llm = registry.chat_openai(model="gpt-3.5-turbo-0125", temperature=0)
 structured_llm_grader = llm.with_structured_output(GradeAnswer)
 
 # Prompt
@@ -193,7 +201,7 @@ answer_grader.invoke({"question": question, "generation": generation})
 ### Question Re-writer
 
 # LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+llm = registry.chat_openai(model="gpt-3.5-turbo-0125", temperature=0)
 
 # Prompt
 system = """You a question re-writer that converts an input question to a better version that is optimized \n 
@@ -232,11 +240,13 @@ class GraphState(TypedDict):
         question: question
         generation: LLM generation
         documents: list of documents
+        budget: LLM calls, tokens and time used so far
     """
 
     question: str
     generation: str
     documents: List[str]
+    budget: dict
 
 
 # Graph Flow
@@ -257,8 +267,8 @@ def retrieve(state) -> dict:
     print("---RETRIEVE---")
     question = state["question"]
 
-    # Retrieval
-    documents = retriever.invoke(question)
+    # Retrieval, keeping the similarity scores for grading
+    documents = retrieve_with_scores(vectorstore, question)
     return {"documents": documents, "question": question}
 
 
@@ -280,6 +290,17 @@ def generate(state) -> dict:
     return {"documents": documents, "question": question, "generation": generation}
 
 
+from nexx.assistants.grading import (
+    grade_relevance,
+    load_thresholds,
+    retrieve_with_scores,
+)
+
+# Clearly relevant or irrelevant documents skip the LLM grader once
+# thresholds are calibrated with `python -m nexx.benchmarks.grader_calibration`.
+cascade_thresholds = load_thresholds(vectorstore.embeddings)
+
+
 def grade_documents(state):
     """
     Determines whether the retrieved documents are relevant to the question.
@@ -297,12 +318,16 @@ def grade_documents(state):
 
     # Score each doc
     filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke(
-            {"question": question, "document": d.page_content}
-        )
-        grade = score.binary_score
-        if grade == "yes":
+    # Grade all docs in one call, or concurrently, in document order
+    relevant = grade_relevance(
+        retrieval_grader,
+        question,
+        documents,
+        listwise=listwise_retrieval_grader,
+        thresholds=cascade_thresholds,
+    )
+    for d, is_relevant in zip(documents, relevant):
+        if is_relevant:
             print("---GRADE: DOCUMENT RELEVANT---")
             filtered_docs.append(d)
         else:
@@ -445,18 +470,61 @@ def grade_generation_v_documents_and_question(state):
         return "not supported"
 
 
+def finalize(state):
+    """
+    Answer with what we have once the time or LLM budget is used up.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): The last generation, or one from the relevant documents,
+            if it is grounded in them, otherwise NO_GROUNDED_ANSWER
+    """
+    print("---BUDGET EXHAUSTED, FINALIZE---")
+    question = state["question"]
+    # Documents are graded or come from a web search by now.
+    documents = state.get("documents") or []
+    if not documents:
+        print("---DECISION: NO RELEVANT DOCUMENTS---")
+        return {"question": question, "generation": NO_GROUNDED_ANSWER}
+    generation = state.get("generation")
+    if not generation:
+        generation = rag_chain.invoke({"context": documents, "question": question})
+    # The budget runs out before the last generation is graded, and it may
+    # be a retry of one that was not grounded.
+    score = hallucination_grader.invoke(
+        {"documents": documents, "generation": generation}
+    )
+    if score.binary_score != "yes":
+        print("---DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS---")
+        generation = NO_GROUNDED_ANSWER
+    return {"question": question, "generation": generation}
+
+
 ### Build graph
 
 from langgraph.graph import END, StateGraph
 
+from nexx.assistants.budget import (
+    FINALIZE,
+    NO_GROUNDED_ANSWER,
+    budget_controller_from_env,
+)
+
+# Loops end in `finalize` after GRAPH_MAX_SECONDS, GRAPH_MAX_LLM_CALLS or
+# GRAPH_MAX_TOKENS.
+controller = budget_controller_from_env()
+
 workflow = StateGraph(GraphState)
 
 # Define the nodes
-workflow.add_node("web_search", web_search)  # web search
-workflow.add_node("retrieve", retrieve)  # retrieve
-workflow.add_node("grade_documents", grade_documents)  # grade documents
-workflow.add_node("generate", generate)  # generate
-workflow.add_node("transform_query", transform_query)  # transform_query
+workflow.add_node("web_search", controller.node(web_search))  # web search
+workflow.add_node("retrieve", controller.node(retrieve))  # retrieve
+workflow.add_node("grade_documents", controller.node(grade_documents))
+workflow.add_node("generate", controller.node(generate))  # generate
+workflow.add_node("transform_query", controller.node(transform_query))
+workflow.add_node(FINALIZE, controller.node(finalize))  # best-effort answer
 
 # Build graph
 workflow.set_conditional_entry_point(
@@ -470,25 +538,31 @@ workflow.add_edge("web_search", "generate")
 workflow.add_edge("retrieve", "grade_documents")
 workflow.add_conditional_edges(
     "grade_documents",
-    decide_to_generate,
+    controller.route(decide_to_generate),
     {
         "transform_query": "transform_query",
         "generate": "generate",
+        FINALIZE: FINALIZE,
     },
 )
 workflow.add_edge("transform_query", "retrieve")
 workflow.add_conditional_edges(
     "generate",
-    grade_generation_v_documents_and_question,
+    controller.route(grade_generation_v_documents_and_question),
     {
         "not supported": "generate",
         "useful": END,
         "not useful": "transform_query",
+        FINALIZE: FINALIZE,
     },
 )
+workflow.add_edge(FINALIZE, END)
 
 # Compile
-app = workflow.compile()
+from nexx.observability.tracing import get_tracer
+
+# Span trees of sampled and slow runs are kept locally, see TRACE_SAMPLE_RATE.
+app = controller.bind(workflow.compile().with_config(callbacks=[get_tracer()]))
 
 
 from pprint import pprint
@@ -28,13 +28,14 @@ retriever = vectorstore.as_retriever()
 ### Router
 
 from langchain.prompts import PromptTemplate
-from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import JsonOutputParser
 
+from nexx.assistants import registry
+
 # LLM
 # Ollama model name
 local_llm = "mistral"
-llm = ChatOllama(model=local_llm, format="json", temperature=0)
+llm = registry.chat_ollama(model=local_llm, format="json", temperature=0)
 
 prompt = PromptTemplate(
     template="""You are an expert at routing a user question to a vectorstore or web search. \n
@@ -55,11 +56,12 @@ print(question_router.invoke({"question": question}))
 ### Retrieval Grader
 
 from langchain.prompts import PromptTemplate
-from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import JsonOutputParser
 
+from nexx.assistants import registry
+
 # LLM
-llm = ChatOllama(model=local_llm, format="json", temperature=0)
+llm = registry.chat_ollama(model=local_llm, format="json", temperature=0)
 
 prompt = PromptTemplate(
     template="""You are a grader assessing relevance of a retrieved document to a user question. \n 
@@ -81,15 +83,16 @@ print(retrieval_grader.invoke({"question": question, "document": doc_txt}))
 
 ### Generate
 
-from langchain import hub
-from langchain_community.chat_models import ChatOllama
 from langchain_core.output_parsers import StrOutputParser
 
+from nexx.assistants import registry
+from nexx.prompts import hub_cache
+
 # Prompt
-prompt = hub.pull("rlm/rag-prompt")
+prompt = hub_cache.pull("rlm/rag-prompt")
 
 # LLM
-llm = ChatOllama(model=local_llm, temperature=0)
+llm = registry.chat_ollama(model=local_llm, temperature=0)
 
 
 # Post-processing
@@ -108,7 +111,7 @@ print(generation)
 ### Hallucination Grader
 
 # LLM
-llm = ChatOllama(model=local_llm, format="json", temperature=0)
+llm = registry.chat_ollama(model=local_llm, format="json", temperature=0)
 
 # Prompt
 prompt = PromptTemplate(
@@ -130,7 +133,7 @@ hallucination_grader.invoke({"documents": docs, "generation": generation})
 ### Answer Grader
 
 # LLM
-llm = ChatOllama(model=local_llm, format="json", temperature=0)
+llm = registry.chat_ollama(model=local_llm, format="json", temperature=0)
 
 # Prompt
 prompt = PromptTemplate(
@@ -151,7 +154,7 @@ answer_grader.invoke({"question": question, "generation": generation})
 ### Question Re-writer
 
 # LLM
-llm = ChatOllama(model=local_llm, temperature=0)
+llm = registry.chat_ollama(model=local_llm, temperature=0)
 
 # Prompt
 re_write_prompt = PromptTemplate(
@@ -211,8 +214,8 @@ def retrieve(state):
     print("---RETRIEVE---")
     question = state["question"]
 
-    # Retrieval
-    documents = retriever.get_relevant_documents(question)
+    # Retrieval, keeping the similarity scores for grading
+    documents = retrieve_with_scores(vectorstore, question)
     return {"documents": documents, "question": question}
 
 
@@ -235,6 +238,17 @@ def generate(state):
     return {"documents": documents, "question": question, "generation": generation}
 
 
+from nexx.assistants.grading import (
+    grade_relevance,
+    load_thresholds,
+    retrieve_with_scores,
+)
+
+# Clearly relevant or irrelevant documents skip the LLM grader once
+# thresholds are calibrated with `python -m nexx.benchmarks.grader_calibration`.
+cascade_thresholds = load_thresholds(vectorstore.embeddings)
+
+
 def grade_documents(state):
     """
     Determines whether the retrieved documents are relevant to the question.
@@ -252,12 +266,12 @@ def grade_documents(state):
 
     # Score each doc
     filtered_docs = []
-    for d in documents:
-        score = retrieval_grader.invoke(
-            {"question": question, "document": d.page_content}
-        )
-        grade = score["score"]
-        if grade == "yes":
+    # Grade all docs concurrently, results come back in document order
+    relevant = grade_relevance(
+        retrieval_grader, question, documents, thresholds=cascade_thresholds
+    )
+    for d, is_relevant in zip(documents, relevant):
+        if is_relevant:
             print("---GRADE: DOCUMENT RELEVANT---")
             filtered_docs.append(d)
         else:
@@ -444,7 +458,10 @@ workflow.add_conditional_edges(
 )
 
 # Compile
-app = workflow.compile()
+from nexx.observability.tracing import get_tracer
+
+# Span trees of sampled and slow runs are kept locally, see TRACE_SAMPLE_RATE.
+app = workflow.compile().with_config(callbacks=[get_tracer()])
 
 # Run
 inputs = {"question": "What is the AlphaCodium paper about?"}
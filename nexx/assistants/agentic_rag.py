@@ -48,19 +48,59 @@ class AgentState(TypedDict):
     # The add_messages function defines how an update should be processed
     # Default is to replace. add_messages says "append"
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    # LLM calls, tokens and time used so far
+    budget: dict
 
 
 from typing import Annotated, Literal, Sequence, TypedDict
 
-from langchain import hub
-from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
 
 from langgraph.prebuilt import tools_condition
 
+from nexx.assistants import registry
+
+# Models, prompts and chains are built once here; the nodes only invoke them.
+
+
+# Data model
+class grade(BaseModel):
+    """Binary score for relevance check."""
+
+    binary_score: str = Field(description="Relevance score 'yes' or 'no'")
+
+
+# LLM with tool and validation
+grader_llm = registry.chat_openai(
+    temperature=0, model="gpt-4-0125-preview", streaming=True
+)
+grader_prompt = PromptTemplate(
+    template="""You are a grader assessing relevance of a retrieved document to a user question. \n 
+    Here is the retrieved document: \n\n {context} \n\n
+    Here is the user question: {question} \n
+    If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+    Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question.""",
+    input_variables=["context", "question"],
+)
+grader_chain = grader_prompt | grader_llm.with_structured_output(grade)
+
+agent_model = registry.with_tools(
+    registry.chat_openai(temperature=0, streaming=True, model="gpt-4-turbo"), tools
+)
+
+rewrite_model = registry.chat_openai(
+    temperature=0, model="gpt-4-0125-preview", streaming=True
+)
+
+rag_prompt = registry.prompt("rlm/rag-prompt")
+rag_llm = registry.chat_openai(
+    model_name="gpt-3.5-turbo", temperature=0, streaming=True
+)
+rag_chain = rag_prompt | rag_llm | StrOutputParser()
+
 ### Edges
 
 
@@ -77,38 +117,13 @@ def grade_documents(state) -> Literal["generate", "rewrite"]:
 
     print("---CHECK RELEVANCE---")
 
-    # Data model
-    class grade(BaseModel):
-        """Binary score for relevance check."""
-
-        binary_score: str = Field(description="Relevance score 'yes' or 'no'")
-
-    # LLM
-    model = ChatOpenAI(temperature=0, model="gpt-4-0125-preview", streaming=True)
-
-    # LLM with tool and validation
-    llm_with_tool = model.with_structured_output(grade)
-
-    # Prompt
-    prompt = PromptTemplate(
-        template="""You are a grader assessing relevance of a retrieved document to a user question. \n 
-        Here is the retrieved document: \n\n {context} \n\n
-        Here is the user question: {question} \n
-        If the document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
-        Give a binary score 'yes' or 'no' score to indicate whether the document is relevant to the question.""",
-        input_variables=["context", "question"],
-    )
-
-    # Chain
-    chain = prompt | llm_with_tool
-
     messages = state["messages"]
     last_message = messages[-1]
 
     question = messages[0].content
     docs = last_message.content
 
-    scored_result = chain.invoke({"question": question, "context": docs})
+    scored_result = grader_chain.invoke({"question": question, "context": docs})
 
     score = scored_result.binary_score
 
@@ -138,9 +153,7 @@ def agent(state):
     """
     print("---CALL AGENT---")
     messages = state["messages"]
-    model = ChatOpenAI(temperature=0, streaming=True, model="gpt-4-turbo")
-    model = model.bind_tools(tools)
-    response = model.invoke(messages)
+    response = agent_model.invoke(messages)
     # We return a list, because this will get added to the existing list
     return {"messages": [response]}
 
@@ -172,9 +185,7 @@ def rewrite(state):
         )
     ]
 
-    # Grader
-    model = ChatOpenAI(temperature=0, model="gpt-4-0125-preview", streaming=True)
-    response = model.invoke(msg)
+    response = rewrite_model.invoke(msg)
     return {"messages": [response]}
 
 
@@ -196,42 +207,61 @@ def generate(state):
     question = messages[0].content
     docs = last_message.content
 
-    # Prompt
-    prompt = hub.pull("rlm/rag-prompt")
+    # Run
+    response = rag_chain.invoke({"context": docs, "question": question})
+    return {"messages": [response]}
 
-    # LLM
-    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0, streaming=True)
 
-    # Post-processing
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
+def finalize(state):
+    """
+    Answer with what we have once the time or LLM budget is used up.
 
-    # Chain
-    rag_chain = prompt | llm | StrOutputParser()
+    Args:
+        state (messages): The current state
 
-    # Run
+    Returns:
+        dict: The agent's answer if it gave one, otherwise an answer from the
+            last retrieved documents
+    """
+    print("---BUDGET EXHAUSTED, FINALIZE---")
+    messages = state["messages"]
+    last_message = messages[-1]
+    if isinstance(last_message, AIMessage) and not last_message.tool_calls:
+        return {}
+
+    question = messages[0].content
+    docs = next(
+        (m.content for m in reversed(messages) if isinstance(m, ToolMessage)), ""
+    )
     response = rag_chain.invoke({"context": docs, "question": question})
     return {"messages": [response]}
 
 
 print("*" * 20 + "Prompt[rlm/rag-prompt]" + "*" * 20)
-prompt = hub.pull("rlm/rag-prompt").pretty_print()  # Show what the prompt looks like
+rag_prompt.pretty_print()  # Show what the prompt looks like
 
 
 from langgraph.graph import END, StateGraph
 from langgraph.prebuilt import ToolNode
 
+from nexx.assistants.budget import FINALIZE, budget_controller_from_env
+
+# The rewrite -> agent -> retrieve loop ends in `finalize` after
+# GRAPH_MAX_SECONDS, GRAPH_MAX_LLM_CALLS or GRAPH_MAX_TOKENS.
+controller = budget_controller_from_env()
+
 # Define a new graph
 workflow = StateGraph(AgentState)
 
 # Define the nodes we will cycle between
-workflow.add_node("agent", agent)  # agent
+workflow.add_node("agent", controller.node(agent))  # agent
 retrieve = ToolNode([retriever_tool])
 workflow.add_node("retrieve", retrieve)  # retrieval
-workflow.add_node("rewrite", rewrite)  # Re-writing the question
+workflow.add_node("rewrite", controller.node(rewrite))  # Re-writing the question
 workflow.add_node(
-    "generate", generate
+    "generate", controller.node(generate)
 )  # Generating a response after we know the documents are relevant
+workflow.add_node(FINALIZE, controller.node(finalize))  # Best-effort answer
 # Call agent node to decide to retrieve or not
 workflow.set_entry_point("agent")
 
@@ -239,11 +269,12 @@ workflow.set_entry_point("agent")
 workflow.add_conditional_edges(
     "agent",
     # Assess agent decision
-    tools_condition,
+    controller.route(tools_condition),
     {
         # Translate the condition outputs to nodes in our graph
         "tools": "retrieve",
         END: END,
+        FINALIZE: FINALIZE,
     },
 )
 
@@ -251,13 +282,17 @@ workflow.add_conditional_edges(
 workflow.add_conditional_edges(
     "retrieve",
     # Assess agent decision
-    grade_documents,
+    controller.route(grade_documents),
 )
 workflow.add_edge("generate", END)
+workflow.add_edge(FINALIZE, END)
 workflow.add_edge("rewrite", "agent")
 
 # Compile
-graph = workflow.compile()
+from nexx.observability.tracing import get_tracer
+
+# Span trees of sampled and slow runs are kept locally, see TRACE_SAMPLE_RATE.
+graph = controller.bind(workflow.compile().with_config(callbacks=[get_tracer()]))
 
 
 import pprint
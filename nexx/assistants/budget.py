@@ -0,0 +1,189 @@
+"""Time, LLM call and token budgets for the looping assistant graphs.
+
+The self-correcting graphs loop back to retrieval or generation until a
+grader is satisfied, which a bad question may never achieve. `RunBudget`
+counts the LLM calls and tokens of one graph run through a callback,
+`BudgetController.node` copies the counts into the graph state, and the
+edges wrapped with `BudgetController.route` send the run to a best-effort
+final answer once the deadline or a budget is exhausted.
+"""
+
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from langchain_core.runnables import Runnable, RunnableBinding, RunnableConfig
+
+logger = logging.getLogger(__name__)
+
+FINALIZE = "finalize"
+
+# Final answer when the budget ran out before a generation passed the
+# hallucination grader.
+NO_GROUNDED_ANSWER = "I could not find an answer grounded in the available documents."
+
+# Rough size of a token, for models that do not report their usage, such
+# as OpenAI models while streaming.
+CHARS_PER_TOKEN = 4
+
+
+class RunBudget(BaseCallbackHandler):
+    """Usage and limits of a single graph run."""
+
+    run_inline = True
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = None,
+        max_llm_calls: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+    ):
+        self.max_seconds = max_seconds
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+        self.started_at = time.monotonic()
+        self.llm_calls = 0
+        self.tokens = 0
+        # Run id -> estimated prompt tokens, until the call ends.
+        self._prompts: Dict[UUID, int] = {}
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs
+    ) -> None:
+        self.llm_calls += 1
+        self._prompts[run_id] = sum(map(len, prompts)) // CHARS_PER_TOKEN
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List],
+        *,
+        run_id: UUID,
+        **kwargs,
+    ) -> None:
+        self.llm_calls += 1
+        chars = sum(len(str(m.content)) for batch in messages for m in batch)
+        self._prompts[run_id] = chars // CHARS_PER_TOKEN
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs) -> None:
+        prompt_tokens = self._prompts.pop(run_id, 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage.get("total_tokens"):
+            self.tokens += usage["total_tokens"]
+            return
+        chars = 0
+        for generations in response.generations:
+            for generation in generations:
+                chars += len(generation.text)
+                message = getattr(generation, "message", None)
+                # Tool calls and structured output arrive as arguments.
+                for call in getattr(message, "tool_calls", None) or []:
+                    chars += len(str(call.get("args", "")))
+        self.tokens += prompt_tokens + chars // CHARS_PER_TOKEN
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        self._prompts.pop(run_id, None)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def exhausted(self) -> Optional[str]:
+        """Which limit has been reached, or None."""
+        if self.max_seconds is not None and self.elapsed() >= self.max_seconds:
+            return "deadline"
+        if self.max_llm_calls is not None and self.llm_calls >= self.max_llm_calls:
+            return "llm_calls"
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return "tokens"
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "elapsed": round(self.elapsed(), 3),
+            "llm_calls": self.llm_calls,
+            "tokens": self.tokens,
+            "exhausted": self.exhausted(),
+        }
+
+
+def _budget(config: Optional[RunnableConfig]) -> Optional[RunBudget]:
+    return ((config or {}).get("configurable") or {}).get("budget")
+
+
+class BudgetController:
+    """Bound the wall-clock time, LLM calls and tokens of a graph run.
+
+    Wrap the nodes with `node`, the conditional edges that can loop with
+    `route`, add a node named `FINALIZE` that answers with what the state
+    has so far, and call `bind` on the compiled graph. Limits are only
+    checked on the wrapped edges, so the node running when a limit is
+    reached and the final answer still finish.
+    """
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = 60,
+        max_llm_calls: Optional[int] = 20,
+        max_tokens: Optional[int] = 50_000,
+    ):
+        self.max_seconds = max_seconds
+        self.max_llm_calls = max_llm_calls
+        self.max_tokens = max_tokens
+
+    def _config(self, config: RunnableConfig) -> RunnableConfig:
+        # A budget from an enclosing run is kept, so nested graphs share it.
+        if _budget(config) is not None:
+            return {}
+        budget = RunBudget(self.max_seconds, self.max_llm_calls, self.max_tokens)
+        return {"callbacks": [budget], "configurable": {"budget": budget}}
+
+    def bind(self, graph: Runnable) -> Runnable:
+        """`graph` with a fresh `RunBudget` for every run."""
+        return RunnableBinding(bound=graph, config_factories=[self._config])
+
+    def node(self, func: Callable[[Dict], Dict]) -> Callable:
+        """A node that also records the usage so far in the state's `budget`."""
+
+        def wrapped(state: Dict, config: RunnableConfig) -> Dict:
+            update = func(state)
+            budget = _budget(config)
+            if budget is not None:
+                update = {**update, "budget": budget.snapshot()}
+            return update
+
+        wrapped.__name__ = func.__name__
+        return wrapped
+
+    def route(self, edge: Callable[[Dict], str], fallback: str = FINALIZE) -> Callable:
+        """A conditional edge that goes to `fallback` once a limit is reached."""
+
+        def wrapped(state: Dict, config: RunnableConfig) -> str:
+            budget = _budget(config)
+            reason = budget.exhausted() if budget is not None else None
+            if reason is not None:
+                logger.warning(f"Budget exhausted ({reason}), finishing early")
+                return fallback
+            return edge(state)
+
+        wrapped.__name__ = edge.__name__
+        return wrapped
+
+
+def budget_controller_from_env() -> BudgetController:
+    """A `BudgetController` configured from the environment.
+
+    GRAPH_MAX_SECONDS (default 60), GRAPH_MAX_LLM_CALLS (default 20) and
+    GRAPH_MAX_TOKENS (default 50000) set the limits; 0 disables a limit.
+    """
+    max_seconds = float(os.environ.get("GRAPH_MAX_SECONDS") or 60)
+    max_llm_calls = int(os.environ.get("GRAPH_MAX_LLM_CALLS") or 20)
+    max_tokens = int(os.environ.get("GRAPH_MAX_TOKENS") or 50_000)
+    return BudgetController(
+        max_seconds=max_seconds or None,
+        max_llm_calls=max_llm_calls or None,
+        max_tokens=max_tokens or None,
+    )
@@ -30,7 +30,8 @@ retriever = vectorstore.as_retriever()
 
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI
+
+from nexx.assistants import registry
 
 
 # Data model
@@ -43,7 +44,7 @@ class GradeDocuments(BaseModel):
 
 
 # LLM with function call
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+llm = registry.chat_openai(model="gpt-3.5-turbo-0125", temperature=0)
 structured_llm_grader = llm.with_structured_output(GradeDocuments)
 
 # Prompt
@@ -58,6 +59,12 @@ grade_prompt = ChatPromptTemplate.from_messages(
 )
 
 retrieval_grader = grade_prompt | structured_llm_grader
+
+from nexx.assistants.grading import listwise_grader
+
+# Grades all retrieved documents of a question in one call, see GRADER_MODE
+listwise_retrieval_grader = listwise_grader(llm)
+
 question = "agent memory"
 docs = retriever.get_relevant_documents(question)
 doc_txt = docs[1].page_content
@@ -66,14 +73,15 @@ print(retrieval_grader.invoke({"question": question, "document": doc_txt}))
 
 ### Generate
 
-from langchain import hub
 from langchain_core.output_parsers import StrOutputParser
 
+from nexx.prompts import hub_cache
+
 # Prompt
-prompt = hub.pull("rlm/rag-prompt")
+prompt = hub_cache.pull("rlm/rag-prompt")
 
 # LLM
-llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+llm = registry.chat_openai(model_name="gpt-3.5-turbo", temperature=0)
 
 
 # Post-processing
@@ -92,7 +100,7 @@ print(generation)
 ### Question Re-writer
 
 # LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0)
+llm = registry.chat_openai(model="gpt-3.5-turbo-0125", temperature=0)
 
 # Prompt
 system = """You a question re-writer that converts an input question to a better version that is optimized \n 
@@ -156,8 +164,8 @@ def retrieve(state):
     print("---RETRIEVE---")
     question = state["question"]
 
-    # Retrieval
-    documents = retriever.get_relevant_documents(question)
+    # Retrieval, keeping the similarity scores for grading
+    documents = retrieve_with_scores(vectorstore, question)
     return {"documents": documents, "question": question}
 
 
@@ -180,6 +188,17 @@ def generate(state):
     return {"documents": documents, "question": question, "generation": generation}
 
 
+from nexx.assistants.grading import (
+    grade_relevance,
+    load_thresholds,
+    retrieve_with_scores,
+)
+
+# Clearly relevant or irrelevant documents skip the LLM grader once
+# thresholds are calibrated with `python -m nexx.benchmarks.grader_calibration`.
+cascade_thresholds = load_thresholds(vectorstore.embeddings)
+
+
 def grade_documents(state):
     """
     Determines whether the retrieved documents are relevant to the question.
@@ -198,12 +217,16 @@ def grade_documents(state):
     # Score each doc
     filtered_docs = []
     web_search = "No"
-    for d in documents:
-        score = retrieval_grader.invoke(
-            {"question": question, "document": d.page_content}
-        )
-        grade = score.binary_score
-        if grade == "yes":
+    # Grade all docs in one call, or concurrently, in document order
+    relevant = grade_relevance(
+        retrieval_grader,
+        question,
+        documents,
+        listwise=listwise_retrieval_grader,
+        thresholds=cascade_thresholds,
+    )
+    for d, is_relevant in zip(documents, relevant):
+        if is_relevant:
             print("---GRADE: DOCUMENT RELEVANT---")
             filtered_docs.append(d)
         else:
@@ -316,7 +339,10 @@ workflow.add_edge("web_search_node", "generate")
 workflow.add_edge("generate", END)
 
 # Compile
-app = workflow.compile()
+from nexx.observability.tracing import get_tracer
+
+# Span trees of sampled and slow runs are kept locally, see TRACE_SAMPLE_RATE.
+app = workflow.compile().with_config(callbacks=[get_tracer()])
 
 
 from pprint import pprint
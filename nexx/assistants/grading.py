@@ -0,0 +1,335 @@
+"""Relevance grading of retrieved documents for the RAG graphs."""
+
+import json
+import logging
+import os
+from typing import Any, List, NamedTuple, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.runnables import Runnable
+from langchain_core.vectorstores import VectorStore
+
+from nexx.observability.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+GRADER_MAX_CONCURRENCY = int(os.environ.get("GRADER_MAX_CONCURRENCY") or "8")
+# "listwise" grades all documents of a question in one call where a
+# listwise grader is given, "pointwise" grades each document on its own.
+GRADER_MODE = (os.environ.get("GRADER_MODE") or "listwise").lower()
+GRADER_THRESHOLDS_PATH = os.environ.get(
+    "GRADER_THRESHOLDS_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "nexx", "grader_thresholds.json"),
+)
+
+# Where the relevance score of a retrieved document is kept.
+SCORE_KEY = "relevance_score"
+
+GRADER_DECISIONS = Counter(
+    "grader_decisions_total",
+    "Retrieved documents accepted or rejected by their similarity score, "
+    "or sent to the LLM grader.",
+    ["decision"],
+)
+
+
+class CascadeThresholds(NamedTuple):
+    # Documents scoring at least `accept` are relevant without an LLM call,
+    # documents scoring below `reject` are not.
+    accept: float
+    reject: float
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """The name thresholds are calibrated and stored under."""
+    return str(getattr(embeddings, "model", None) or type(embeddings).__name__)
+
+
+def load_thresholds(
+    embeddings: Embeddings, path: str = GRADER_THRESHOLDS_PATH
+) -> Optional[CascadeThresholds]:
+    """Thresholds calibrated for `embeddings` by `grader_calibration`.
+
+    Scores of different embedding models are not comparable, so without
+    thresholds for this model every document goes to the LLM grader.
+    """
+    name = embedding_model_name(embeddings)
+    try:
+        with open(path, encoding="utf-8") as f:
+            calibrated = json.load(f).get(name)
+    except FileNotFoundError:
+        calibrated = None
+    if calibrated is None:
+        logger.info(f"No grader thresholds for {name}, grading every document")
+        return None
+    return CascadeThresholds(calibrated["accept"], calibrated["reject"])
+
+
+def save_thresholds(
+    embeddings: Embeddings,
+    thresholds: CascadeThresholds,
+    path: str = GRADER_THRESHOLDS_PATH,
+    **stats: Any,
+) -> None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            calibrated = json.load(f)
+    except FileNotFoundError:
+        calibrated = {}
+    calibrated[embedding_model_name(embeddings)] = {**thresholds._asdict(), **stats}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(calibrated, f, indent=2)
+
+
+def retrieve_with_scores(
+    vectorstore: VectorStore, question: str, k: int = 4
+) -> List[Document]:
+    """The documents `vectorstore.as_retriever()` returns, with their scores.
+
+    The relevance score of the similarity search is kept in the metadata
+    under `SCORE_KEY`, so grading can reuse the embeddings of retrieval.
+    """
+    documents = []
+    for document, score in vectorstore.similarity_search_with_relevance_scores(
+        question, k=k
+    ):
+        document.metadata[SCORE_KEY] = score
+        documents.append(document)
+    return documents
+
+
+def _cascade(
+    documents: Sequence[Document], thresholds: Optional[CascadeThresholds]
+) -> List[Optional[bool]]:
+    """Relevance decided by score alone, None where the LLM has to grade."""
+    decided: List[Optional[bool]] = []
+    for d in documents:
+        score = d.metadata.get(SCORE_KEY)
+        if thresholds is None or score is None:
+            decided.append(None)
+        elif score >= thresholds.accept:
+            decided.append(True)
+        elif score < thresholds.reject:
+            decided.append(False)
+        else:
+            decided.append(None)
+    for decision, label in ((True, "accept"), (False, "reject"), (None, "llm")):
+        count = decided.count(decision)
+        if count:
+            GRADER_DECISIONS.inc(count, decision=label)
+    return decided
+
+
+def _merge(decided: List[Optional[bool]], graded: List[bool]) -> List[bool]:
+    remaining = iter(graded)
+    return [d if d is not None else next(remaining) for d in decided]
+
+
+class DocumentGrade(BaseModel):
+    """Binary score for relevance check on one retrieved document."""
+
+    id: int = Field(description="Id of the document")
+    binary_score: str = Field(
+        description="Document is relevant to the question, 'yes' or 'no'"
+    )
+
+
+class GradeDocumentList(BaseModel):
+    """Binary scores for relevance check on a list of retrieved documents."""
+
+    grades: List[DocumentGrade] = Field(
+        description="One grade for every document id, in any order"
+    )
+
+
+LISTWISE_SYSTEM = """You are a grader assessing relevance of retrieved documents to a user question. \n
+Every document is enclosed in <document id="..."> tags. Grade each document on its own. \n
+If a document contains keyword(s) or semantic meaning related to the user question, grade it as relevant. \n
+It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
+Return one binary score 'yes' or 'no' for every document id."""
+
+listwise_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system", LISTWISE_SYSTEM),
+        (
+            "human",
+            "Retrieved documents: \n\n {documents} \n\n User question: {question}",
+        ),
+    ]
+)
+
+
+def listwise_grader(llm: BaseChatModel) -> Runnable:
+    """A grader of all documents of a question, for `grade_relevance`."""
+    return listwise_prompt | llm.with_structured_output(GradeDocumentList)
+
+
+def format_documents(documents: Sequence[Document]) -> str:
+    return "\n\n".join(
+        f'<document id="{i}">\n{d.page_content}\n</document>'
+        for i, d in enumerate(documents)
+    )
+
+
+def _is_relevant(score: Any) -> bool:
+    # Structured output graders return a model, JSON graders a dict.
+    if isinstance(score, dict):
+        return score.get("score") == "yes"
+    return score.binary_score == "yes"
+
+
+def _inputs(question: str, documents: Sequence[Document]) -> List[dict]:
+    return [{"question": question, "document": d.page_content} for d in documents]
+
+
+def _listwise_input(question: str, documents: Sequence[Document]) -> dict:
+    return {"question": question, "documents": format_documents(documents)}
+
+
+def _listwise_relevance(result: Optional[GradeDocumentList], count: int) -> List[bool]:
+    if result is None:
+        raise OutputParserException("The grader returned no grades")
+    grades = {grade.id: _is_relevant(grade) for grade in result.grades}
+    missing = set(range(count)) - set(grades)
+    if missing:
+        raise OutputParserException(f"No grades for documents {sorted(missing)}")
+    return [grades[i] for i in range(count)]
+
+
+def _use_listwise(listwise: Optional[Runnable], documents: Sequence) -> bool:
+    return listwise is not None and GRADER_MODE == "listwise" and len(documents) > 1
+
+
+def _grade_with_llm(
+    grader: Runnable,
+    question: str,
+    documents: Sequence[Document],
+    max_concurrency: int,
+    listwise: Optional[Runnable],
+) -> List[bool]:
+    if _use_listwise(listwise, documents):
+        try:
+            result = listwise.invoke(_listwise_input(question, documents))
+            return _listwise_relevance(result, len(documents))
+        except (OutputParserException, ValueError) as e:
+            logger.warning(f"Listwise grading failed, grading each document: {e}")
+    scores = grader.batch(
+        _inputs(question, documents), config={"max_concurrency": max_concurrency}
+    )
+    return [_is_relevant(score) for score in scores]
+
+
+async def _agrade_with_llm(
+    grader: Runnable,
+    question: str,
+    documents: Sequence[Document],
+    max_concurrency: int,
+    listwise: Optional[Runnable],
+) -> List[bool]:
+    if _use_listwise(listwise, documents):
+        try:
+            result = await listwise.ainvoke(_listwise_input(question, documents))
+            return _listwise_relevance(result, len(documents))
+        except (OutputParserException, ValueError) as e:
+            logger.warning(f"Listwise grading failed, grading each document: {e}")
+    scores = await grader.abatch(
+        _inputs(question, documents), config={"max_concurrency": max_concurrency}
+    )
+    return [_is_relevant(score) for score in scores]
+
+
+def grade_relevance(
+    grader: Runnable,
+    question: str,
+    documents: Sequence[Document],
+    max_concurrency: int = GRADER_MAX_CONCURRENCY,
+    listwise: Optional[Runnable] = None,
+    thresholds: Optional[CascadeThresholds] = None,
+) -> List[bool]:
+    """Whether each document is relevant, in the order of `documents`.
+
+    With `thresholds`, documents whose retrieval score is clearly high or
+    clearly low are decided without the LLM. The rest are graded in one
+    call with a `listwise` grader, and only if its answer cannot be parsed
+    or misses a document are they graded one by one with `grader`. Those
+    calls run concurrently, at most `max_concurrency` at a time, so grading
+    takes about one grader call instead of one per document.
+    """
+    decided = _cascade(documents, thresholds)
+    ambiguous = [d for d, decision in zip(documents, decided) if decision is None]
+    graded = []
+    if ambiguous:
+        graded = _grade_with_llm(grader, question, ambiguous, max_concurrency, listwise)
+    return _merge(decided, graded)
+
+
+async def agrade_relevance(
+    grader: Runnable,
+    question: str,
+    documents: Sequence[Document],
+    max_concurrency: int = GRADER_MAX_CONCURRENCY,
+    listwise: Optional[Runnable] = None,
+    thresholds: Optional[CascadeThresholds] = None,
+) -> List[bool]:
+    """Async version of `grade_relevance`."""
+    decided = _cascade(documents, thresholds)
+    ambiguous = [d for d, decision in zip(documents, decided) if decision is None]
+    graded = []
+    if ambiguous:
+        graded = await _agrade_with_llm(
+            grader, question, ambiguous, max_concurrency, listwise
+        )
+    return _merge(decided, graded)
+
+
+def calibrate_thresholds(
+    scores: Sequence[float],
+    labels: Sequence[bool],
+    min_precision: float = 0.95,
+    min_support: int = 20,
+) -> CascadeThresholds:
+    """Thresholds for the cascade from scores of labelled documents.
+
+    `accept` is lowered from the highest score for as long as at least
+    `min_precision` of the documents at or above it are relevant, and
+    `reject` is raised from the lowest score for as long as at least
+    `min_precision` of the documents below it are irrelevant. Precision is
+    only trusted once at least `min_support` documents are on that side, so
+    a handful of lucky scores does not set a threshold. A side with no such
+    score never decides anything.
+    """
+    ascending = sorted(zip(scores, labels))
+
+    accept = float("inf")
+    relevant = 0
+    descending = ascending[::-1]
+    for i, (score, label) in enumerate(descending):
+        relevant += bool(label)
+        if i + 1 < len(descending) and descending[i + 1][0] == score:
+            continue
+        if i + 1 < min_support:
+            continue
+        if relevant / (i + 1) < min_precision:
+            break
+        accept = score
+
+    reject = float("-inf")
+    irrelevant = 0
+    for i, (score, label) in enumerate(ascending):
+        irrelevant += not label
+        if i + 1 < len(ascending) and ascending[i + 1][0] == score:
+            continue
+        if i + 1 < min_support:
+            continue
+        if irrelevant / (i + 1) < min_precision:
+            break
+        # Everything scoring up to here is rejected.
+        reject = ascending[i + 1][0] if i + 1 < len(ascending) else float("inf")
+    # Never reject what would be accepted.
+    return CascadeThresholds(accept=accept, reject=min(reject, accept))
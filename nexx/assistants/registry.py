@@ -0,0 +1,112 @@
+"""Process-wide model clients and prompts shared by the assistant graphs.
+
+Graph nodes run on every request. Building a chat model there creates a
+new OpenAI client with its own connection pool, and looking up a prompt
+there can mean a network round trip. Models and prompts are therefore
+built once, here, and the nodes only look them up.
+
+With LLM_BACKEND=fake every model is a `FakeStreamingChatModel`, seeded
+by its arguments, so the graphs run without API keys or a local server.
+"""
+
+import os
+import threading
+import zlib
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import httpx
+from langchain_community.chat_models import ChatOllama
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import BasePromptTemplate
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
+
+from nexx.llms.fake import fake_chat_model_from_env, use_fake_llm
+from nexx.prompts import hub_cache
+
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS") or "64")
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE") or "16")
+
+_lock = threading.RLock()
+_http_clients: Optional[Tuple[httpx.Client, httpx.AsyncClient]] = None
+_models: Dict[Tuple, BaseChatModel] = {}
+_bound: Dict[Tuple, Runnable] = {}
+_prompts: Dict[str, BasePromptTemplate] = {}
+
+
+def _key(kwargs: Dict[str, Any]) -> Tuple:
+    return tuple(sorted(kwargs.items()))
+
+
+def http_clients() -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """The sync and async HTTP clients all OpenAI models share."""
+    global _http_clients
+    with _lock:
+        if _http_clients is None:
+            limits = httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            )
+            _http_clients = (
+                httpx.Client(limits=limits),
+                httpx.AsyncClient(limits=limits),
+            )
+        return _http_clients
+
+
+def _model(key: Tuple, build: Callable[[], BaseChatModel]) -> BaseChatModel:
+    model = _models.get(key)
+    if model is None:
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                if use_fake_llm():
+                    model = fake_chat_model_from_env(
+                        seed=zlib.crc32(repr(key).encode("utf-8")),
+                        format=dict(key[1:]).get("format"),
+                    )
+                else:
+                    model = build()
+                _models[key] = model
+    return model
+
+
+def chat_openai(**kwargs) -> BaseChatModel:
+    """A `ChatOpenAI` for these arguments, built on first use."""
+
+    def build() -> ChatOpenAI:
+        http_client, http_async_client = http_clients()
+        return ChatOpenAI(
+            http_client=http_client, http_async_client=http_async_client, **kwargs
+        )
+
+    return _model(("openai",) + _key(kwargs), build)
+
+
+def chat_ollama(**kwargs) -> BaseChatModel:
+    """A `ChatOllama` for these arguments, built on first use."""
+    return _model(("ollama",) + _key(kwargs), lambda: ChatOllama(**kwargs))
+
+
+def with_tools(model: BaseChatModel, tools: Sequence[Any]) -> Runnable:
+    """`model.bind_tools(tools)`, bound once per model and tool set."""
+    key = (id(model),) + tuple(id(tool) for tool in tools)
+    bound = _bound.get(key)
+    if bound is None:
+        with _lock:
+            bound = _bound.get(key)
+            if bound is None:
+                bound = model.bind_tools(tools)
+                _bound[key] = bound
+    return bound
+
+
+def prompt(name: str) -> BasePromptTemplate:
+    """A LangChain Hub prompt, looked up once per process."""
+    template = _prompts.get(name)
+    if template is None:
+        with _lock:
+            template = _prompts.get(name)
+            if template is None:
+                template = _prompts[name] = hub_cache.pull(name)
+    return template
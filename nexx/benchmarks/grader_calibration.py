@@ -0,0 +1,150 @@
+"""Calibrate the similarity thresholds of the relevance grading cascade.
+
+The labelled set is a JSONL file with one graded pair per line:
+
+    {"question": "What is task decomposition?", "document": "...", "relevant": true}
+
+Run with
+
+    python -m nexx.benchmarks.grader_calibration labelled.jsonl --embeddings openai
+
+Documents are scored the way the graphs score them, by a Chroma similarity
+search with the same embedding model, and the thresholds are stored per
+embedding model in GRADER_THRESHOLDS_PATH, where the graphs load them.
+"""
+
+import argparse
+import json
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from nexx.assistants.grading import (
+    GRADER_THRESHOLDS_PATH,
+    CascadeThresholds,
+    calibrate_thresholds,
+    embedding_model_name,
+    save_thresholds,
+)
+
+
+def load_labelled(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_embeddings(name: str) -> Embeddings:
+    # The models the assistant graphs index their documents with.
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings()
+    if name == "nomic":
+        from langchain_nomic.embeddings import NomicEmbeddings
+
+        return NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local")
+    if name == "fake":
+        from nexx.embeddings.fake import FakeEmbeddings
+
+        return FakeEmbeddings(latency=0, per_text=0)
+    raise ValueError(f"Unknown embeddings {name}")
+
+
+def score_pairs(embeddings: Embeddings, pairs: List[dict]) -> List[Tuple[float, bool]]:
+    """The retrieval relevance score and label of every labelled pair."""
+    texts = sorted({pair["document"] for pair in pairs})
+    vectorstore = Chroma.from_documents(
+        [Document(page_content=text) for text in texts],
+        embedding=embeddings,
+        collection_name="grader-calibration",
+    )
+    by_question: Dict[str, List[dict]] = defaultdict(list)
+    for pair in pairs:
+        by_question[pair["question"]].append(pair)
+    scored = []
+    try:
+        for question, labelled in by_question.items():
+            results = vectorstore.similarity_search_with_relevance_scores(
+                question, k=len(texts)
+            )
+            scores = {document.page_content: score for document, score in results}
+            for pair in labelled:
+                scored.append((scores[pair["document"]], bool(pair["relevant"])))
+    finally:
+        vectorstore.delete_collection()
+    return scored
+
+
+def report(scored: List[Tuple[float, bool]], thresholds: CascadeThresholds) -> dict:
+    if not scored:
+        raise ValueError("Cannot report on an empty labelled set")
+    accepted = [label for score, label in scored if score >= thresholds.accept]
+    rejected = [label for score, label in scored if score < thresholds.reject]
+    return {
+        "samples": len(scored),
+        "accepted": len(accepted),
+        "rejected": len(rejected),
+        "coverage": round((len(accepted) + len(rejected)) / len(scored), 4),
+        "accept_precision": (
+            round(sum(accepted) / len(accepted), 4) if accepted else None
+        ),
+        "reject_precision": (
+            round(1 - sum(rejected) / len(rejected), 4) if rejected else None
+        ),
+    }
+
+
+def main(
+    labelled_path: str,
+    embeddings_name: str,
+    min_precision: float,
+    min_support: int,
+    output: str,
+    dry_run: bool,
+) -> None:
+    pairs = load_labelled(labelled_path)
+    if not pairs:
+        raise SystemExit(f"{labelled_path} has no labelled pairs")
+    embeddings = get_embeddings(embeddings_name)
+    scored = score_pairs(embeddings, pairs)
+    thresholds = calibrate_thresholds(
+        [score for score, _ in scored],
+        [label for _, label in scored],
+        min_precision=min_precision,
+        min_support=min_support,
+    )
+    stats = report(scored, thresholds)
+    print(f"{embedding_model_name(embeddings)}: {thresholds}")
+    print(json.dumps(stats, indent=2))
+    if not dry_run:
+        save_thresholds(embeddings, thresholds, output, **stats)
+        print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("labelled", help="JSONL file of labelled pairs")
+    parser.add_argument(
+        "--embeddings", default="openai", choices=["openai", "nomic", "fake"]
+    )
+    parser.add_argument("--min-precision", type=float, default=0.95)
+    parser.add_argument(
+        "--min-support",
+        type=int,
+        default=20,
+        help="labelled pairs needed at or above accept and below reject",
+    )
+    parser.add_argument("--output", default=GRADER_THRESHOLDS_PATH)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    main(
+        args.labelled,
+        args.embeddings,
+        args.min_precision,
+        args.min_support,
+        args.output,
+        args.dry_run,
+    )
@@ -0,0 +1,93 @@
+"""Compare time-to-first-token of a plain and a latency-hedged stub LLM.
+
+Run with `python -m nexx.benchmarks.hedging`.
+"""
+
+import asyncio
+import random
+import time
+from typing import AsyncIterator, List
+
+from langchain_core.runnables import Runnable, RunnableGenerator
+
+from nexx.llms.hedging import LatencyHedgedRunnable
+
+TOKENS = ["Lang", "Chain", " is", " a", " framework", "."]
+
+
+def stub_llm(
+    seed: int,
+    ttft: float,
+    jitter: float,
+    slow_rate: float,
+    slow_ttft: float,
+    token_interval: float = 0.002,
+) -> Runnable:
+    """A streaming stub whose first token is sometimes very late."""
+    rng = random.Random(seed)
+
+    async def generate(input: AsyncIterator) -> AsyncIterator[str]:
+        async for _ in input:
+            pass
+        delay = slow_ttft if rng.random() < slow_rate else ttft
+        await asyncio.sleep(delay + rng.random() * jitter)
+        for token in TOKENS:
+            yield token
+            await asyncio.sleep(token_interval)
+
+    return RunnableGenerator(generate)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))]
+
+
+async def measure(runnable: Runnable, requests: int, concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    ttfts: List[float] = []
+
+    async def one() -> None:
+        async with semaphore:
+            start = time.monotonic()
+            first = None
+            async for _ in runnable.astream("What is LangChain?"):
+                if first is None:
+                    first = time.monotonic() - start
+            ttfts.append(first)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return ttfts
+
+
+def report(name: str, ttfts: List[float]) -> None:
+    print(
+        f"{name:<10} p50={percentile(ttfts, 0.5) * 1000:7.1f}ms "
+        f"p95={percentile(ttfts, 0.95) * 1000:7.1f}ms "
+        f"p99={percentile(ttfts, 0.99) * 1000:7.1f}ms"
+    )
+
+
+async def main(requests: int = 1000, concurrency: int = 20) -> None:
+    def primary() -> Runnable:
+        # Fast on average, but 5% of requests stall for a full second.
+        return stub_llm(seed=1, ttft=0.03, jitter=0.02, slow_rate=0.05, slow_ttft=1.0)
+
+    secondary = stub_llm(seed=2, ttft=0.06, jitter=0.02, slow_rate=0.0, slow_ttft=0)
+
+    baseline = await measure(primary(), requests, concurrency)
+    hedged_llm = LatencyHedgedRunnable(
+        primary(), secondary, percentile=0.9, initial_delay=0.1
+    )
+    hedged = await measure(hedged_llm, requests, concurrency)
+
+    report("primary", baseline)
+    report("hedged", hedged)
+    print(
+        f"hedged {hedged_llm.hedged_requests}/{requests} requests, "
+        f"secondary won {hedged_llm.secondary_wins}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+"""Drive the chat server at a target request rate and report latencies.
+
+Start the server with fake backends so runs are cheap and reproducible:
+
+    LLM_BACKEND=fake EMBEDDINGS_BACKEND=fake python -m nexx.main_server
+
+then run for example
+
+    python -m nexx.benchmarks.load_test --qps 20 --duration 30
+
+Requests are sent open-loop, on a fixed schedule that does not wait for
+earlier responses, so a slow server shows up as growing latency instead of
+a lower request rate.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+import httpx
+
+from nexx.benchmarks.hedging import percentile
+
+QUESTIONS = [
+    "What is LangChain?",
+    "How do I use a retriever?",
+    "What is LCEL?",
+    "How do I stream tokens from a chain?",
+    "What is a vector store?",
+    "How do I add memory to a chain?",
+    "What is LangSmith?",
+    "How do I call tools with an agent?",
+]
+
+
+class Result:
+    def __init__(self):
+        self.status: Optional[int] = None
+        self.error: Optional[str] = None
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.chunks = 0
+
+
+async def send(client: httpx.AsyncClient, url: str, payload: dict) -> Result:
+    result = Result()
+    start = time.monotonic()
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            result.status = response.status_code
+            if response.status_code == 200:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:") :].strip()
+                    elif line.startswith("data:") and event == "data":
+                        if json.loads(line[len("data:") :]):
+                            result.chunks += 1
+                            if result.ttft is None:
+                                result.ttft = time.monotonic() - start
+            else:
+                await response.aread()
+    except httpx.HTTPError as e:
+        result.error = type(e).__name__
+    result.latency = time.monotonic() - start
+    return result
+
+
+def report(results: List[Result], elapsed: float) -> None:
+    ok = [r for r in results if r.status == 200 and r.error is None]
+    statuses = Counter(r.error or r.status for r in results)
+    print(f"requests    {len(results)} in {elapsed:.1f}s, outcomes {dict(statuses)}")
+    print(f"throughput  {len(ok) / elapsed:.2f} successful requests/s")
+    for name, samples in (
+        ("latency", [r.latency for r in ok]),
+        ("ttft", [r.ttft for r in ok if r.ttft is not None]),
+    ):
+        if samples:
+            print(
+                f"{name:<11} p50={percentile(samples, 0.5) * 1000:7.1f}ms "
+                f"p95={percentile(samples, 0.95) * 1000:7.1f}ms "
+                f"p99={percentile(samples, 0.99) * 1000:7.1f}ms"
+            )
+
+
+async def main(
+    url: str,
+    qps: float,
+    duration: float,
+    priority: str,
+    unique: float,
+    seed: int,
+    timeout: float,
+) -> None:
+    rng = random.Random(seed)
+    total = int(qps * duration)
+    results: List[Result] = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(
+        timeout=timeout, limits=limits, headers={"X-Priority": priority}
+    ) as client:
+
+        async def fire(at: float, payload: dict) -> None:
+            await asyncio.sleep(max(0.0, at - time.monotonic()))
+            results.append(await send(client, url, payload))
+
+        start = time.monotonic()
+        tasks = []
+        for i in range(total):
+            # A share of the questions are unique, the rest repeat popular ones.
+            if rng.random() < unique:
+                question = f"{rng.choice(QUESTIONS)} ({i})"
+            else:
+                question = rng.choice(QUESTIONS)
+            payload = {"input": {"question": question, "session_id": str(uuid.uuid4())}}
+            tasks.append(asyncio.create_task(fire(start + i / qps, payload)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8001/chat/langchain/stream")
+    parser.add_argument("--qps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--priority", default="interactive")
+    parser.add_argument(
+        "--unique", type=float, default=1.0, help="share of unique questions"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            args.url,
+            args.qps,
+            args.duration,
+            args.priority,
+            args.unique,
+            args.seed,
+            args.timeout,
+        )
+    )
@@ -0,0 +1,147 @@
+"""Compare the SSE decoder with the line-by-line parsing it replaced.
+
+Run with `python -m nexx.benchmarks.sse`, optionally on a stream recorded
+from a running server:
+
+    python -m nexx.benchmarks.sse --record http://localhost:8001/chat/langchain/stream_events
+    python -m nexx.benchmarks.sse --recording stream.sse
+"""
+
+import argparse
+import json
+import random
+import time
+from typing import Callable, Iterable, Iterator, List
+
+from nexx.clients.events import event_content, process_event_data
+from nexx.clients.sse import SSEDecoder
+
+RECORDING_PATH = "stream.sse"
+
+
+def synthetic_stream(events: int = 10_000, seed: int = 0) -> bytes:
+    """A `stream_events` response: mostly chain events, some model tokens.
+
+    Payloads are compact JSON, as LangServe writes them with orjson.
+    """
+    rng = random.Random(seed)
+    parts = [b'event: metadata\r\ndata: {"run_id": "0"}\r\n\r\n']
+    for i in range(events - 2):
+        if rng.random() < 0.3:
+            token = rng.choice(["Lang", "Chain", " is", " a", " framework", "."])
+            payload = {
+                "event": "on_chat_model_stream",
+                "name": "ChatOpenAI",
+                "run_id": str(i),
+                "data": {"chunk": {"content": token, "type": "AIMessageChunk"}},
+            }
+        else:
+            kind = rng.choice(["on_chain_start", "on_chain_stream", "on_chain_end"])
+            data = {"input": {"question": "What is LangChain?"}}
+            if kind == "on_chain_end":
+                # Chain ends carry their output, e.g. the retrieved documents.
+                data["output"] = [
+                    {"page_content": "LangChain " * 50, "metadata": {"source": str(j)}}
+                    for j in range(rng.randint(0, 6))
+                ]
+            payload = {
+                "event": kind,
+                "name": "RunnableSequence",
+                "run_id": str(i),
+                "tags": ["seq:step:1"],
+                "data": data,
+            }
+        encoded = json.dumps(payload, separators=(",", ":")).encode()
+        parts.append(b"event: data\r\ndata: " + encoded + b"\r\n\r\n")
+    parts.append(b"event: end\r\n\r\n")
+    return b"".join(parts)
+
+
+def chunked(stream: bytes, seed: int = 0, max_size: int = 2048) -> List[bytes]:
+    """Split a stream at random points, like network reads do."""
+    rng = random.Random(seed)
+    chunks, i = [], 0
+    while i < len(stream):
+        size = rng.randint(1, max_size)
+        chunks.append(stream[i : i + size])
+        i += size
+    return chunks
+
+
+def legacy_contents(chunks: Iterable[bytes]) -> Iterator[str]:
+    """The previous client: split lines, then `startswith` and `json.loads`."""
+    pending = b""
+    for chunk in chunks:
+        *lines, pending = (pending + chunk).split(b"\n")
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if not line:
+                continue
+            decoded_line = line.decode("utf-8")
+            if decoded_line.startswith("data: "):
+                try:
+                    content = process_event_data(json.loads(decoded_line[6:]))
+                except json.JSONDecodeError as e:
+                    content = f"JSON decoding error: {e}\n\n"
+            elif decoded_line.startswith("event: ") or ": ping" in decoded_line:
+                content = None
+            else:
+                content = decoded_line
+            if content:
+                yield content
+
+
+def decoder_contents(chunks: Iterable[bytes]) -> Iterator[str]:
+    for event in SSEDecoder().decode(chunks):
+        content = event_content(event)
+        if content:
+            yield content
+
+
+def measure(name: str, parse: Callable, chunks: List[bytes], rounds: int) -> str:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        output = "".join(parse(chunks))
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<8} {best * 1000:8.1f}ms  {len(chunks) / best:12.0f} chunks/s")
+    return output
+
+
+def record(url: str, path: str, question: str) -> None:
+    import httpx
+
+    payload = {"input": {"question": question}}
+    with httpx.stream("POST", url, json=payload, timeout=None) as response:
+        with open(path, "wb") as f:
+            for chunk in response.iter_raw():
+                f.write(chunk)
+    print(f"Recorded {url} to {path}")
+
+
+def main(recording: str = "", rounds: int = 5) -> None:
+    if recording:
+        with open(recording, "rb") as f:
+            stream = f.read()
+    else:
+        stream = synthetic_stream()
+    chunks = chunked(stream)
+    events = sum(1 for _ in SSEDecoder().decode(chunks))
+    print(f"{events} events, {len(stream)} bytes, {len(chunks)} chunks")
+    legacy = measure("legacy", legacy_contents, chunks, rounds)
+    decoded = measure("decoder", decoder_contents, chunks, rounds)
+    if legacy != decoded:
+        print("Outputs differ")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recording", default="")
+    parser.add_argument("--record", default="", help="URL to record a stream from")
+    parser.add_argument("--question", default="What is LangChain?")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    if args.record:
+        record(args.record, args.recording or RECORDING_PATH, args.question)
+    else:
+        main(args.recording, args.rounds)
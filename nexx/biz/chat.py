@@ -39,6 +39,3 @@ prompt = ChatPromptTemplate.from_messages(
 )
 
 print()
-
-
-from langsmith.wrappers import wrap_openai
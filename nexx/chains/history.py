@@ -0,0 +1,189 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from langchain_core.language_models import LanguageModelLike
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+from langchain_core.runnables import Runnable, RunnableLambda
+
+from nexx.prompts.langchain_prompt import (
+    HISTORY_SUMMARY_ACK,
+    HISTORY_SUMMARY_TEMPLATE,
+    SUMMARIZE_HISTORY_TEMPLATE,
+)
+
+
+def turns_to_messages(turns: Sequence[Dict[str, str]]) -> List[BaseMessage]:
+    """Convert `{"human": ..., "ai": ...}` turns into chat messages."""
+    messages: List[BaseMessage] = []
+    for turn in turns:
+        if turn.get("human") is not None:
+            messages.append(HumanMessage(content=turn["human"]))
+        if turn.get("ai") is not None:
+            messages.append(AIMessage(content=turn["ai"]))
+    return messages
+
+
+def _format_turns(turns: Sequence[Dict[str, str]]) -> str:
+    lines = []
+    for turn in turns:
+        if turn.get("human") is not None:
+            lines.append(f"Human: {turn['human']}")
+        if turn.get("ai") is not None:
+            lines.append(f"AI: {turn['ai']}")
+    return "\n".join(lines)
+
+
+def _digest(turns: Sequence[Dict[str, str]]) -> str:
+    payload = json.dumps(list(turns), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _position(turns: Sequence[Dict], i: int) -> int:
+    # Turns from the session store carry their `seq`, which does not shift
+    # when the store drops old turns; a client's history is only indexed.
+    return turns[i].get("seq", i)
+
+
+def _fold_digest(turns: Sequence[Dict]) -> str:
+    """Digest checking that the folded turns are still the same.
+
+    A client may edit any turn, so its whole history is compared. Stored
+    turns cannot change and older ones may have been dropped, so only the
+    last folded turn, with its seq, is.
+    """
+    if turns and "seq" in turns[-1]:
+        return _digest(turns[-1:])
+    return _digest(turns)
+
+
+class _Summary(NamedTuple):
+    # Position of the first turn not in the summary, see `_position`.
+    folded: int
+    digest: str
+    text: str
+
+
+class HistoryManager:
+    """Keep the last turns verbatim and fold older ones into a summary.
+
+    At most `max_turns + fold_batch - 1` turns are passed on verbatim. Once
+    the history grows past that, everything but the last `max_turns` turns is
+    folded into a running summary with a single LLM call, so the prompt size
+    stays bounded however long the conversation gets.
+
+    Summaries are cached per `session_id` (or per conversation, keyed on its
+    first turn, when the client sends none) and only the newly aged-out turns
+    are folded into them. The cache entry is checked against a digest of the
+    folded turns, so an edited history is summarized again from scratch.
+    Turns are counted by their `seq` where they have one, so a summary stays
+    valid when the session store drops the oldest turns.
+    """
+
+    def __init__(
+        self,
+        llm: LanguageModelLike,
+        max_turns: int = 4,
+        fold_batch: int = 2,
+        max_sessions: int = 1024,
+    ):
+        self.max_turns = max_turns
+        self.fold_batch = fold_batch
+        self.max_sessions = max_sessions
+        self.summarize_chain = (
+            PromptTemplate.from_template(SUMMARIZE_HISTORY_TEMPLATE)
+            | llm
+            | StrOutputParser()
+        ).with_config(run_name="SummarizeHistory")
+        self._summaries: OrderedDict[str, _Summary] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(
+        self, key: str, turns: Sequence[Dict[str, str]]
+    ) -> Tuple[_Summary, int]:
+        """The cached summary and the index of the first turn it leaves out."""
+        with self._lock:
+            cached = self._summaries.get(key)
+            if cached is not None:
+                self._summaries.move_to_end(key)
+        if cached is not None and cached.folded:
+            start = 0
+            while start < len(turns) and _position(turns, start) < cached.folded:
+                start += 1
+            if start and cached.digest == _fold_digest(turns[:start]):
+                return cached, start
+        return _Summary(0, _digest([]), ""), 0
+
+    def _store(self, key: str, summary: _Summary) -> None:
+        with self._lock:
+            self._summaries[key] = summary
+            self._summaries.move_to_end(key)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+
+    def _plan(self, request: Dict):
+        turns = request.get("chat_history") or []
+        if len(turns) < self.max_turns + self.fold_batch:
+            return turns, None, None, 0, None
+        key = request.get("session_id") or _digest(turns[:1])
+        summary, start = self._lookup(key, turns)
+        if len(turns) - start < self.max_turns + self.fold_batch:
+            return turns, key, summary, start, None
+        return turns, key, summary, start, len(turns) - self.max_turns
+
+    def _messages(
+        self, turns: Sequence[Dict[str, str]], summary: Optional[_Summary], start: int
+    ) -> List[BaseMessage]:
+        if summary is None or not summary.folded:
+            return turns_to_messages(turns)
+        # Gemini only accepts a system message at the start of the prompt, so
+        # the summary goes in as a human/ai exchange after the system prompt.
+        return [
+            HumanMessage(content=HISTORY_SUMMARY_TEMPLATE.format(summary=summary.text)),
+            AIMessage(content=HISTORY_SUMMARY_ACK),
+        ] + turns_to_messages(turns[start:])
+
+    def _folded(
+        self, key: str, turns: Sequence[Dict[str, str]], fold_to: int, text: str
+    ) -> _Summary:
+        summary = _Summary(
+            _position(turns, fold_to - 1) + 1, _fold_digest(turns[:fold_to]), text
+        )
+        self._store(key, summary)
+        return summary
+
+    def compact(self, request: Dict, config=None) -> List[BaseMessage]:
+        """Return the bounded chat history of a `ChatInput` request."""
+        turns, key, summary, start, fold_to = self._plan(request)
+        if fold_to is not None:
+            text = self.summarize_chain.invoke(
+                {
+                    "summary": summary.text,
+                    "new_lines": _format_turns(turns[start:fold_to]),
+                },
+                config,
+            )
+            summary, start = self._folded(key, turns, fold_to, text), fold_to
+        return self._messages(turns, summary, start)
+
+    async def acompact(self, request: Dict, config=None) -> List[BaseMessage]:
+        turns, key, summary, start, fold_to = self._plan(request)
+        if fold_to is not None:
+            text = await self.summarize_chain.ainvoke(
+                {
+                    "summary": summary.text,
+                    "new_lines": _format_turns(turns[start:fold_to]),
+                },
+                config,
+            )
+            summary, start = self._folded(key, turns, fold_to, text), fold_to
+        return self._messages(turns, summary, start)
+
+    def as_runnable(self) -> Runnable:
+        return RunnableLambda(self.compact, afunc=self.acompact).with_config(
+            run_name="CompactHistory"
+        )
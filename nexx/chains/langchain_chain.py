@@ -1,12 +1,11 @@
 import os
-from operator import itemgetter
-from typing import Dict, List, Optional, Sequence
+import re
+from typing import Dict, List, Optional, Sequence, Union
 
 # from langchain_community.llms import Ollama
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
 from langchain_core.language_models import LanguageModelLike
-from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import (
     ChatPromptTemplate,
@@ -16,42 +15,161 @@ from langchain_core.prompts import (
 from langchain_core.pydantic_v1 import BaseModel
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.runnables import (
-    ConfigurableField,
     Runnable,
     RunnableBranch,
     RunnableLambda,
+    RunnableParallel,
     RunnablePassthrough,
 )
+from langchain_core.runnables.config import RunnableConfig
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_openai import ChatOpenAI
 
-from future.ingests.langchain_ingest import get_embeddings_model
-from future.prompts.langchain_prompt import REPHRASE_TEMPLATE, RESPONSE_TEMPLATE
+from nexx.chains.history import HistoryManager, turns_to_messages
+from nexx.ingests.langchain_ingest import get_embeddings_model
+from nexx.llms.budget import derive_output_budget, sentence_cutoff, with_max_tokens
+from nexx.llms.fake import fake_chat_model_from_env, use_fake_llm
+from nexx.llms.hedging import LatencyHedgedRunnable
+from nexx.llms.router import LatencyRouter
+from nexx.prompts.langchain_prompt import (
+    MULTI_QUERY_TEMPLATE,
+    REPHRASE_TEMPLATE,
+    RESPONSE_TEMPLATE,
+)
+from nexx.retrievers.adaptive import AdaptiveKRetriever
+from nexx.retrievers.cached import CachedRetriever
+from nexx.retrievers.filtered import (
+    FilteredVectorStoreRetriever,
+    MetadataFilterRetriever,
+)
+from nexx.retrievers.parent_document import SmallToBigRetriever, get_parent_docstore
 
 
 class ChatInput(BaseModel):
     question: str
-    chat_history: Optional[List[Dict[str, str]]]
+    # Left out by clients that let the server keep the history of their
+    # `session_id`, see `nexx.server.sessions`.
+    chat_history: Optional[List[Dict[str, str]]] = None
+    session_id: Optional[str] = None
+    # Restrict retrieval by metadata, e.g. {"doc_set": "langsmith"} or
+    # {"language": ["en", "zh"]}, see `nexx.retrievers.filtered`.
+    filters: Optional[Dict[str, Union[str, List[str]]]] = None
 
 
 def get_retriever() -> BaseRetriever:
     embedding_model = get_embeddings_model()
-    chroma_client = Chroma(
-        collection_name="langchain", embedding_function=embedding_model
+    retrieval_mode = (os.environ.get("RETRIEVAL_MODE") or "chunk").lower()
+    if retrieval_mode == "parent":
+        # Match on small chunks, answer from the sections they belong to.
+        collection_name = "langchain_children"
+        retriever = SmallToBigRetriever(
+            vectorstore=Chroma(
+                collection_name=collection_name, embedding_function=embedding_model
+            ),
+            docstore=get_parent_docstore(),
+        )
+    else:
+        collection_name = "langchain"
+        chroma_client = Chroma(
+            collection_name=collection_name, embedding_function=embedding_model
+        )
+        if retrieval_mode == "adaptive":
+            # Pick k from the score distribution instead of always using 6.
+            retriever = AdaptiveKRetriever(vectorstore=chroma_client)
+        else:
+            retriever = FilteredVectorStoreRetriever(vectorstore=chroma_client, k=6)
+    # Repeated standalone questions skip embedding and the vector search.
+    retriever = CachedRetriever(retriever=retriever, collection_name=collection_name)
+    return MetadataFilterRetriever(retriever=retriever, collection_name=collection_name)
+
+
+def parse_queries(text: str, num_queries: int) -> List[str]:
+    queries = []
+    for line in text.splitlines():
+        # Models like to number or bullet the queries despite the prompt.
+        query = re.sub(r"^\s*(?:[-*•]|\d+[.)、])\s*", "", line).strip()
+        if query and query not in queries:
+            queries.append(query)
+    return queries[:num_queries]
+
+
+def fuse_documents(
+    results: Sequence[Sequence[Document]], k: int, rrf_k: int = 60
+) -> List[Document]:
+    """Deduplicate several result lists with reciprocal rank fusion."""
+    scores: Dict[tuple, float] = {}
+    unique_docs: Dict[tuple, Document] = {}
+    for docs in results:
+        for rank, doc in enumerate(docs):
+            key = (doc.metadata.get("source"), doc.page_content)
+            unique_docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [unique_docs[key] for key in ranked[:k]]
+
+
+def create_retrieve_step(retriever: BaseRetriever) -> Runnable:
+    """Retrieve for a `{"question": ..., "filters": ...}` dict."""
+
+    def retrieve(x: Dict, config: RunnableConfig) -> List[Document]:
+        return retriever.invoke(x["question"], config, filters=x.get("filters"))
+
+    async def aretrieve(x: Dict, config: RunnableConfig) -> List[Document]:
+        return await retriever.ainvoke(x["question"], config, filters=x.get("filters"))
+
+    return RunnableLambda(retrieve, afunc=aretrieve).with_config(run_name="Retrieve")
+
+
+def create_multi_query_retriever(
+    llm: LanguageModelLike, retrieve: Runnable, num_queries: int = 3, k: int = 6
+) -> Runnable:
+    """Retrieve for the question and a few LLM-written variants of it.
+
+    The variants come from a single LLM call that runs concurrently with the
+    retrieval for the original question, and the variant retrievals run
+    concurrently with each other, so the stage costs about one LLM call plus
+    one retrieval. The result lists are fused into at most `k` documents.
+    """
+    MULTI_QUERY_PROMPT = PromptTemplate.from_template(MULTI_QUERY_TEMPLATE).partial(
+        num_queries=str(num_queries)
+    )
+    generate_queries = (
+        MULTI_QUERY_PROMPT
+        | llm
+        | StrOutputParser()
+        | RunnableLambda(lambda text: parse_queries(text, num_queries))
+    ).with_config(run_name="GenerateQueries")
+    variants = RunnablePassthrough.assign(queries=generate_queries) | RunnableLambda(
+        lambda x: [
+            {"question": query, "filters": x.get("filters")} for query in x["queries"]
+        ]
     )
-    return chroma_client.as_retriever(search_kwargs=dict(k=6))
+    return (
+        RunnableParallel(
+            original=retrieve,
+            variants=variants | retrieve.map(),
+        )
+        | RunnableLambda(
+            lambda x: fuse_documents([x["original"], *x["variants"]], k)
+        ).with_config(run_name="FuseDocuments")
+    ).with_config(run_name="MultiQueryRetriever")
 
 
 def create_retriever_chain(
-    llm: LanguageModelLike, retriever: BaseRetriever
+    llm: LanguageModelLike, retriever: BaseRetriever, multi_query: bool = False
 ) -> Runnable:
+    retrieve = create_retrieve_step(retriever)
+    if multi_query:
+        retrieve = create_multi_query_retriever(llm, retrieve)
     CONDENSE_QUESTION_PROMPT = PromptTemplate.from_template(REPHRASE_TEMPLATE)
     condense_question_chain = (
         CONDENSE_QUESTION_PROMPT | llm | StrOutputParser()
     ).with_config(
         run_name="CondenseQuestion",
     )
-    conversation_chain = condense_question_chain | retriever
+    conversation_chain = (
+        RunnablePassthrough.assign(question=condense_question_chain) | retrieve
+    )
     return RunnableBranch(
         (
             RunnableLambda(lambda x: bool(x.get("chat_history"))).with_config(
@@ -59,12 +177,7 @@ def create_retriever_chain(
             ),
             conversation_chain.with_config(run_name="RetrievalChainWithHistory"),
         ),
-        (
-            RunnableLambda(itemgetter("question")).with_config(
-                run_name="Itemgetter:question"
-            )
-            | retriever
-        ).with_config(run_name="RetrievalChainWithNoHistory"),
+        retrieve.with_config(run_name="RetrievalChainWithNoHistory"),
     ).with_config(run_name="RouteDependingOnChatHistory")
 
 
@@ -78,19 +191,19 @@ def format_docs(docs: Sequence[Document]) -> str:
 
 def serialize_history(request: ChatInput):
     chat_history = request["chat_history"] or []
-    converted_chat_history = []
-    for message in chat_history:
-        if message.get("human") is not None:
-            converted_chat_history.append(HumanMessage(content=message["human"]))
-        if message.get("ai") is not None:
-            converted_chat_history.append(AIMessage(content=message["ai"]))
-    return converted_chat_history
+    return turns_to_messages(chat_history)
 
 
-def create_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
+def create_chain(
+    llm: LanguageModelLike,
+    retriever: BaseRetriever,
+    multi_query: bool = False,
+    response_llm: Optional[LanguageModelLike] = None,
+) -> Runnable:
     retriever_chain = create_retriever_chain(
         llm,
         retriever,
+        multi_query=multi_query,
     ).with_config(run_name="FindDocs")
     context = (
         RunnablePassthrough.assign(docs=retriever_chain)
@@ -104,39 +217,71 @@ def create_chain(llm: LanguageModelLike, retriever: BaseRetriever) -> Runnable:
             ("human", "{question}"),
         ]
     )
-    default_response_synthesizer = prompt | llm
-
+    # The backend is picked by `llm` itself, see `LatencyRouter`. The answer
+    # is cut at a sentence end once it runs past what the prompt asks for.
     response_synthesizer = (
-        default_response_synthesizer.configurable_alternatives(
-            ConfigurableField("llm"),
-            default_key="openai_gpt_3_5_turbo",
-            anthropic_claude_3_haiku=default_response_synthesizer,
-            google_gemini_pro=default_response_synthesizer,
-        )
+        prompt
+        | (response_llm or llm)
         | StrOutputParser()
+        | sentence_cutoff(RESPONSE_BUDGET.max_chars)
     ).with_config(run_name="GenerateResponse")
+    # Older turns are folded into a per-session summary so the prompts stay
+    # the same size however long the conversation gets.
+    history_manager = HistoryManager(llm)
     return (
-        RunnablePassthrough.assign(chat_history=serialize_history)
+        RunnablePassthrough.assign(chat_history=history_manager.as_runnable())
         | context
         | response_synthesizer
     )
 
 
-gpt_3_5 = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0, streaming=True)
-gemini_pro = ChatGoogleGenerativeAI(
-    model="gemini-pro",
-    temperature=0,
-    max_tokens=16384,
-    convert_system_message_to_human=True,
-    google_api_key=os.environ.get("GOOGLE_API_KEY", "not_provided"),
-)
-llm = gpt_3_5.configurable_alternatives(
-    # This gives this field an id
-    # When configuring the end runnable, we can then use this id to configure this field
-    ConfigurableField(id="llm"),
+# Output budgets derived from the length each prompt asks for. Condensing,
+# query variants and history summaries share the auxiliary budget.
+RESPONSE_BUDGET = derive_output_budget(RESPONSE_TEMPLATE)
+AUXILIARY_BUDGET = derive_output_budget(REPHRASE_TEMPLATE, default_chars=300)
+
+if use_fake_llm():
+    # Offline benchmarking: same routing, hedging and budgets, no paid API.
+    gpt_3_5 = fake_chat_model_from_env(seed=1)
+    gemini_pro = fake_chat_model_from_env(seed=2)
+else:
+    gpt_3_5 = ChatOpenAI(model="gpt-3.5-turbo-0125", temperature=0, streaming=True)
+    gemini_pro = ChatGoogleGenerativeAI(
+        model="gemini-pro",
+        temperature=0,
+        convert_system_message_to_human=True,
+        google_api_key=os.environ.get("GOOGLE_API_KEY", "not_provided"),
+    )
+# Holds the routing statistics shared by every LLM made by `create_llm`.
+llm_router = LatencyRouter(
+    # Clients pin a backend with {"configurable": {"llm": <key>}}, otherwise
+    # every request goes to the currently fastest healthy one.
+    {"openai_gpt_3_5_turbo": gpt_3_5, "google_gemini_pro": gemini_pro},
     default_key="openai_gpt_3_5_turbo",
-    google_gemini_pro=gemini_pro,
-).with_fallbacks([gpt_3_5, gemini_pro])
+    # Former backend that clients may still pin; it always got the default.
+    aliases={"anthropic_claude_3_haiku": "openai_gpt_3_5_turbo"},
+)
+
+
+def create_llm(max_tokens: int) -> Runnable:
+    """Routed LLM whose every backend generates at most `max_tokens` tokens."""
+    gpt = with_max_tokens(gpt_3_5, max_tokens)
+    gemini = with_max_tokens(gemini_pro, max_tokens)
+    router = llm_router.with_backends(
+        {"openai_gpt_3_5_turbo": gpt, "google_gemini_pro": gemini}
+    )
+    # Hedge the slow tail of the routed backend with a request to Gemini. The
+    # router only sees its own request, so its statistics stay per backend.
+    return LatencyHedgedRunnable(router, gemini).with_fallbacks([gpt, gemini])
+
+
+llm = create_llm(AUXILIARY_BUDGET.max_tokens)
+response_llm = create_llm(RESPONSE_BUDGET.max_tokens)
 
 retriever = get_retriever()
-answer_chain = create_chain(llm, retriever)
+answer_chain = create_chain(
+    llm,
+    retriever,
+    multi_query=(os.environ.get("MULTI_QUERY") or "false").lower() == "true",
+    response_llm=response_llm,
+)
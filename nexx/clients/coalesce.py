@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+from typing import Iterable, Iterator
+
+_DONE = object()
+_TIMEOUT = object()
+
+
+def coalesce(
+    chunks: Iterable[str], interval: float = 0.05, max_chars: int = 2048
+) -> Iterator[str]:
+    """Merge a fast text stream into fewer, larger chunks.
+
+    The first chunk is passed on at once, so the time to first token does
+    not change. After that, chunks are buffered and flushed when `interval`
+    seconds have passed since the first buffered chunk arrived, or when
+    `max_chars` characters are buffered. `chunks` is read in a background
+    thread, so a buffered tail is flushed on time even when the stream
+    stalls. Errors are raised after the text received before them.
+    """
+    pending: queue.Queue = queue.Queue()
+    stop = threading.Event()
+
+    def pump() -> None:
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                pending.put(chunk)
+            pending.put(_DONE)
+        except BaseException as e:
+            pending.put(e)
+
+    threading.Thread(target=pump, daemon=True).start()
+    buffer = []
+    size = 0
+    deadline = 0.0
+    first = True
+    try:
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if buffer else None
+            try:
+                item = pending.get(timeout=timeout)
+            except queue.Empty:
+                item = _TIMEOUT
+            if item is _TIMEOUT or item is _DONE or isinstance(item, BaseException):
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                if item is _DONE:
+                    return
+                if item is not _TIMEOUT:
+                    raise item
+                continue
+            if first:
+                first = False
+                yield item
+                continue
+            if not buffer:
+                deadline = time.monotonic() + interval
+            buffer.append(item)
+            size += len(item)
+            if size >= max_chars or time.monotonic() >= deadline:
+                yield "".join(buffer)
+                buffer, size = [], 0
+    finally:
+        stop.set()
@@ -0,0 +1,69 @@
+import json
+import re
+
+from nexx.clients.sse import ServerSentEvent
+
+# LangServe events that never carry content, skipped without decoding.
+SKIPPED_EVENTS = frozenset({"metadata", "end"})
+# `stream_events` kinds that are rendered, see `handle_event`.
+CONTENT_EVENT_KINDS = frozenset(
+    {"on_chat_model_stream", "on_tool_start", "on_tool_end"}
+)
+# The kind at the start of a `stream_events` payload, with or without the
+# spaces `json.dumps` puts after separators (LangServe uses orjson, which
+# puts none).
+_EVENT_KIND = re.compile(r'\{\s*"event"\s*:\s*"([^"]*)"')
+
+
+def event_content(event: ServerSentEvent):
+    """把一个 SSE 事件转换成要显示的内容，没有内容时返回 None"""
+    if event.event in SKIPPED_EVENTS:
+        return None
+    if event.event == "error":
+        return f"An error occurred: {event.data}\n\n"
+    data = event.data
+    match = _EVENT_KIND.match(data)
+    if match and match.group(1) not in CONTENT_EVENT_KINDS:
+        # stream_events 的 JSON 以 {"event":"<kind>" 开头，只看开头就能跳过
+        # on_chain_start 等事件，不做 JSON 解析
+        return None
+    try:
+        return process_event_data(json.loads(data))
+    except json.JSONDecodeError as e:
+        return f"JSON decoding error: {e}\n\n"
+
+
+def process_event_data(data):
+    """处理事件数据"""
+    if isinstance(data, str):
+        return data  # /stream 接口直接输出文本块
+    if "event" in data:
+        return handle_event(data)
+    elif "content" in data or "steps" in data or "output" in data:
+        return f"{data.get('content') or data.get('steps') or data.get('output')}\n"
+
+
+def handle_event(data):
+    """处理特定的事件类型"""
+    kind = data["event"]
+    if kind == "on_chat_model_stream":
+        return (
+            data["data"]["chunk"]["content"]
+            if data["data"]["chunk"]["content"]
+            else None
+        )
+    elif kind == "on_tool_start":
+        return handle_tool_start(data)
+    elif kind == "on_tool_end":
+        return "Search completed.\n"
+
+
+def handle_tool_start(data):
+    """处理工具开始事件"""
+    tool_inputs = data["data"].get("input")
+    inputs_str = (
+        ", ".join(f"'{v}'" for k, v in tool_inputs.items())
+        if isinstance(tool_inputs, dict)
+        else str(tool_inputs)
+    )
+    return f"Searching Tool: {data['name']} with input: {inputs_str} ⏳\n"
@@ -0,0 +1,116 @@
+import asyncio
+import importlib.util
+import logging
+import queue
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def http2_available() -> bool:
+    """HTTP/2 needs the optional `h2` package (`pip install httpx[http2]`)."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class StreamingClient:
+    """Pooled HTTP client that reads streaming responses on its own loop.
+
+    One `httpx.AsyncClient` with keep-alive, and HTTP/2 when `h2` is
+    installed, runs on an event loop in a background thread, so connections
+    and TLS sessions are reused across requests. `stream_lines` and
+    `stream_bytes` hand the response to the calling thread through a queue
+    of at most `buffer_size` items while the next chunks are being read.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 10,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 5.0,
+        read_timeout: Optional[float] = 120.0,
+        buffer_size: int = 1024,
+    ):
+        self.buffer_size = buffer_size
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._client = httpx.AsyncClient(
+            http2=http2_available(),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        )
+
+    async def _put(self, out: queue.Queue, stop: threading.Event, item: Any) -> bool:
+        # Waits without blocking the loop while the caller is behind.
+        while not stop.is_set():
+            try:
+                out.put_nowait(item)
+                return True
+            except queue.Full:
+                await asyncio.sleep(0.005)
+        return False
+
+    async def _read(
+        self,
+        out: queue.Queue,
+        stop: threading.Event,
+        lines: bool,
+        method: str,
+        url: str,
+        kwargs: Dict[str, Any],
+    ) -> None:
+        try:
+            async with self._client.stream(method, url, **kwargs) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                chunks: AsyncIterator = (
+                    response.aiter_lines() if lines else response.aiter_bytes()
+                )
+                async for chunk in chunks:
+                    if not await self._put(out, stop, chunk):
+                        return
+            await self._put(out, stop, _DONE)
+        except Exception as e:
+            await self._put(out, stop, e)
+
+    def _stream(self, lines: bool, method: str, url: str, **kwargs: Any) -> Iterator:
+        out: queue.Queue = queue.Queue(maxsize=self.buffer_size)
+        stop = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._read(out, stop, lines, method, url, kwargs), self._loop
+        )
+        try:
+            while True:
+                item = out.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # The caller stopped early: close the response. Over HTTP/2 only the
+            # stream is reset; a partly read HTTP/1.1 connection is dropped.
+            stop.set()
+            future.cancel()
+
+    def stream_lines(self, method: str, url: str, **kwargs: Any) -> Iterator[str]:
+        """Decoded lines of a streaming response, without line endings."""
+        return self._stream(True, method, url, **kwargs)
+
+    def stream_bytes(self, method: str, url: str, **kwargs: Any) -> Iterator[bytes]:
+        """Raw chunks of a streaming response, as they arrive."""
+        return self._stream(False, method, url, **kwargs)
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,150 @@
+"""Incremental Server-Sent Events decoding.
+
+Follows the event stream interpretation of the HTML specification: lines
+end in CR, LF or CRLF, `data` fields of one event are joined with newlines,
+comments (lines starting with a colon) are ignored, and the `id` and
+`retry` fields are remembered for reconnecting.
+"""
+
+import logging
+import time
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class ServerSentEvent(NamedTuple):
+    event: str
+    data: str
+    id: str
+    retry: Optional[int]
+
+
+class SSEDecoder:
+    """Turn chunks of bytes, split anywhere, into `ServerSentEvent`s.
+
+    The decoder keeps only the unfinished last line between `feed` calls.
+    The payload is left undecoded, so callers can look at `event` first and
+    skip the events they do not need without parsing their JSON.
+    """
+
+    def __init__(self):
+        self.last_event_id = ""
+        self.retry: Optional[int] = None
+        self._buffer = b""
+        self._started = False
+        self._skip_lf = False
+        self._event = ""
+        self._data: List[bytes] = []
+
+    def feed(self, chunk: bytes) -> Iterator[ServerSentEvent]:
+        if not chunk:
+            return
+        if not self._started:
+            self._started = True
+            if chunk.startswith(b"\xef\xbb\xbf"):
+                chunk = chunk[3:]
+        if self._skip_lf:
+            # The previous chunk ended in CR, this LF belongs to that CRLF.
+            self._skip_lf = False
+            if chunk[:1] == b"\n":
+                chunk = chunk[1:]
+        buffer = self._buffer + chunk if self._buffer else chunk
+        lines = buffer.splitlines(keepends=True)
+        self._buffer = b""
+        if lines and not lines[-1].endswith((b"\n", b"\r")):
+            self._buffer = lines.pop()
+        elif lines and lines[-1].endswith(b"\r"):
+            self._skip_lf = True
+        data = self._data
+        for line in lines:
+            line = line.rstrip(b"\r\n")
+            if not line:
+                event = self._dispatch()
+                if event is not None:
+                    yield event
+                data = self._data
+            elif line[:5] == b"data:":
+                # The most common fields, handled without a method call.
+                data.append(line[6:] if line[5:6] == b" " else line[5:])
+            elif line[:7] == b"event: ":
+                self._event = line[7:].decode("utf-8", "replace")
+            elif line[:1] != b":":
+                self._field(line)
+
+    def _field(self, line: bytes) -> None:
+        name, colon, value = line.partition(b":")
+        if colon and value[:1] == b" ":
+            value = value[1:]
+        if name == b"data":
+            self._data.append(value)
+        elif name == b"event":
+            self._event = value.decode("utf-8", "replace")
+        elif name == b"id":
+            if b"\0" not in value:
+                self.last_event_id = value.decode("utf-8", "replace")
+        elif name == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+
+    def _dispatch(self) -> Optional[ServerSentEvent]:
+        data, event = self._data, self._event
+        self._data, self._event = [], ""
+        if not data:
+            return None
+        return ServerSentEvent(
+            event=event or "message",
+            data=b"\n".join(data).decode("utf-8", "replace"),
+            id=self.last_event_id,
+            retry=self.retry,
+        )
+
+    def decode(self, chunks: Iterable[bytes]) -> Iterator[ServerSentEvent]:
+        """Decode a whole stream. An unterminated last event is dropped."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+
+
+def iter_events(
+    client,
+    method: str,
+    url: str,
+    max_reconnects: int = 3,
+    headers: Optional[dict] = None,
+    **kwargs,
+) -> Iterator[ServerSentEvent]:
+    """Events of a streaming request made with a `StreamingClient`.
+
+    When the connection drops after the server has sent an event `id`, the
+    request is repeated with a `Last-Event-ID` header, after the server's
+    `retry` delay, so a server that supports it can resume the stream.
+    Without an id there is nothing to resume from and the error is raised.
+    """
+    decoder = SSEDecoder()
+    reconnects = 0
+    while True:
+        request_headers = dict(headers or {})
+        if decoder.last_event_id:
+            request_headers["Last-Event-ID"] = decoder.last_event_id
+        try:
+            yield from decoder.decode(
+                client.stream_bytes(method, url, headers=request_headers, **kwargs)
+            )
+            return
+        except httpx.TransportError:
+            if not decoder.last_event_id or reconnects >= max_reconnects:
+                raise
+            reconnects += 1
+            # Whatever was left of the interrupted event is incomplete.
+            decoder = _resume(decoder)
+            logger.warning(f"Reconnecting to {url} after {decoder.last_event_id}")
+            time.sleep((decoder.retry or 1000) / 1000)
+
+
+def _resume(decoder: SSEDecoder) -> SSEDecoder:
+    resumed = SSEDecoder()
+    resumed.last_event_id = decoder.last_event_id
+    resumed.retry = decoder.retry
+    return resumed
@@ -0,0 +1,48 @@
+import json
+import zlib
+from typing import Dict, List, Tuple
+
+
+class Transcript:
+    """Chat messages with only a recent window kept ready to render.
+
+    Messages are `{"role": ..., "content": ...}` dicts, stored as tuples.
+    Once more than `window + segment_size` messages are recent, the oldest
+    `segment_size` of them are folded into a zlib-compressed segment, so at
+    most `window + segment_size - 1` messages are rendered on every rerun
+    and older ones are only decompressed when a segment is expanded.
+    """
+
+    def __init__(self, window: int = 20, segment_size: int = 20):
+        self.window = window
+        self.segment_size = segment_size
+        self.recent: List[Tuple[str, str]] = []
+        self.segments: List[bytes] = []
+
+    def __len__(self) -> int:
+        return len(self.segments) * self.segment_size + len(self.recent)
+
+    def append(self, message: Dict[str, str]) -> None:
+        self.recent.append((message["role"], message["content"]))
+        if len(self.recent) >= self.window + self.segment_size:
+            folded = self.recent[: self.segment_size]
+            self.recent = self.recent[self.segment_size :]
+            payload = json.dumps(folded, ensure_ascii=False).encode("utf-8")
+            self.segments.append(zlib.compress(payload))
+
+    def clear(self) -> None:
+        self.recent.clear()
+        self.segments.clear()
+
+    def segment(self, index: int) -> List[Dict[str, str]]:
+        """Messages of an older segment, oldest first."""
+        folded = json.loads(zlib.decompress(self.segments[index]))
+        return [{"role": role, "content": content} for role, content in folded]
+
+    def segment_range(self, index: int) -> Tuple[int, int]:
+        """1-based positions of the first and last message of a segment."""
+        start = index * self.segment_size
+        return start + 1, start + self.segment_size
+
+    def recent_messages(self) -> List[Dict[str, str]]:
+        return [{"role": role, "content": content} for role, content in self.recent]
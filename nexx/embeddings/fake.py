@@ -0,0 +1,47 @@
+import asyncio
+import hashlib
+import math
+import struct
+import time
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.pydantic_v1 import BaseModel
+
+
+class FakeEmbeddings(BaseModel, Embeddings):
+    """Deterministic embeddings with a configurable latency.
+
+    Each text maps to a unit vector derived from its hash, so equal texts
+    get equal vectors. A call takes `latency` seconds plus `per_text`
+    seconds per text, like a remote embedding API would.
+    """
+
+    size: int = 768
+    latency: float = 0.02
+    per_text: float = 0.001
+
+    def _embed(self, text: str) -> List[float]:
+        values: List[float] = []
+        counter = 0
+        while len(values) < self.size:
+            block = hashlib.sha256(f"{counter}\n{text}".encode("utf-8")).digest()
+            values.extend(v / 2**31 for v in struct.unpack("<8i", block))
+            counter += 1
+        values = values[: self.size]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency + self.per_text * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency + self.per_text * len(texts))
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,50 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Dict, Tuple
+
+# Shared between the ingest job and the server, so it lives on disk.
+INDEX_VERSION_PATH = os.environ.get(
+    "INDEX_VERSION_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "nexx", "index_versions.json"),
+)
+
+_lock = threading.Lock()
+_cached: Tuple[Tuple[str, int, int], Dict[str, int]] = (("", -1, -1), {})
+
+
+def _read_versions(path: str) -> Dict[str, int]:
+    global _cached
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    # Bumps replace the file, so the inode changes even within one mtime tick.
+    stamp = (path, stat.st_mtime_ns, stat.st_ino)
+    with _lock:
+        if _cached[0] == stamp:
+            return _cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        versions = json.load(f)
+    with _lock:
+        _cached = (stamp, versions)
+    return versions
+
+
+def get_index_version(collection_name: str, path: str = INDEX_VERSION_PATH) -> int:
+    """Current version of a collection's index, 0 if it was never bumped."""
+    return _read_versions(path).get(collection_name, 0)
+
+
+def bump_index_version(collection_name: str, path: str = INDEX_VERSION_PATH) -> int:
+    """Mark a collection as changed, invalidating cached retrieval results."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    versions = dict(_read_versions(path))
+    versions[collection_name] = versions.get(collection_name, 0) + 1
+    # Write atomically so readers never see a partially written file.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(versions, f)
+    os.replace(tmp_path, path)
+    return versions[collection_name]
@@ -1,23 +1,55 @@
 import logging
 import os
+from typing import List
 
 from langchain.indexes import SQLRecordManager, index
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.utils.html import PREFIXES_TO_IGNORE_REGEX, SUFFIXES_TO_IGNORE_REGEX
 from langchain_community.embeddings import OllamaEmbeddings
 from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
 
-from future.loaders.langchain_loader import LangchainDocsLoader, LangsmithDocsLoader
+from nexx.embeddings.fake import FakeEmbeddings
+from nexx.ingests.index_version import bump_index_version
+from nexx.loaders.langchain_loader import LangchainDocsLoader, LangsmithDocsLoader
+from nexx.retrievers.filtered import MetadataIndex, normalize_metadata
+from nexx.retrievers.parent_document import (
+    PARENT_ID_KEY,
+    get_parent_docstore,
+    parent_id,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 def get_embeddings_model() -> Embeddings:
+    if (os.environ.get("EMBEDDINGS_BACKEND") or "").lower() == "fake":
+        return FakeEmbeddings(
+            latency=float(os.environ.get("FAKE_EMBEDDINGS_LATENCY") or 0.02)
+        )
     return OllamaEmbeddings(model="nomic-embed-text")
 
 
+def split_parent_documents(parents: List[Document]) -> List[Document]:
+    """Store parent sections in the docstore and return their child chunks."""
+    docstore = get_parent_docstore()
+    ids = [parent_id(parent) for parent in parents]
+    docstore.mset(list(zip(ids, parents)))
+    stale_ids = set(docstore.yield_keys()) - set(ids)
+    docstore.mdelete(list(stale_ids))
+    logger.info(f"Stored {len(ids)} parents, removed {len(stale_ids)} stale ones")
+
+    for id, parent in zip(ids, parents):
+        parent.metadata[PARENT_ID_KEY] = id
+    child_splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=50)
+    children = child_splitter.split_documents(parents)
+    children = [doc for doc in children if len(doc.page_content) > 10]
+    logger.info(f"Split {len(parents)} parents into {len(children)} children")
+    return children
+
+
 def ingest_docs():
     DATABASE_HOST = "127.0.0.1"
     DATABASE_PORT = "3306"
@@ -48,16 +80,32 @@ def ingest_docs():
     docs_from_langsmith = langsmith_docs_loader.load_langsmith_docs()
     logger.info(f"Loaded {len(docs_from_langsmith)} docs from Langsmith")
 
+    for doc in docs_from_documentation:
+        doc.metadata["doc_set"] = "langchain"
+    for doc in docs_from_langsmith:
+        doc.metadata["doc_set"] = "langsmith"
+
     docs_transformed = text_splitter.split_documents(
         docs_from_documentation + docs_from_langsmith
     )
     docs_transformed = [doc for doc in docs_transformed if len(doc.page_content) > 10]
 
     for doc in docs_transformed:
-        if "source" not in doc.metadata:
-            doc.metadata["source"] = ""
-        if "title" not in doc.metadata:
-            doc.metadata["title"] = ""
+        normalize_metadata(doc)
+
+    if (os.environ.get("RETRIEVAL_MODE") or "chunk").lower() == "parent":
+        # Small-to-big: embed small children, keep the sections they were cut
+        # from in a compressed docstore and return those at query time.
+        COLLECTION_NAME = f"{COLLECTION_NAME}_children"
+        vectorstore = Chroma(
+            collection_name=COLLECTION_NAME,
+            embedding_function=embedding,
+        )
+        record_manager = SQLRecordManager(
+            f"pingan_health/{COLLECTION_NAME}", db_url=RECORD_MANAGER_DB_URL
+        )
+        record_manager.create_schema()
+        docs_transformed = split_parent_documents(docs_transformed)
 
     indexing_stats = index(
         docs_transformed,
@@ -70,6 +118,13 @@ def ingest_docs():
 
     logger.info(f"Indexing stats: {indexing_stats}")
 
+    # Lets the server validate filters and skip ones that cannot match.
+    MetadataIndex.from_documents(docs_transformed).save(COLLECTION_NAME)
+
+    if any(indexing_stats[key] for key in ("num_added", "num_updated", "num_deleted")):
+        version = bump_index_version(COLLECTION_NAME)
+        logger.info(f"Bumped {COLLECTION_NAME} index version to {version}")
+
 
 if __name__ == "__main__":
     ingest_docs()
@@ -0,0 +1,120 @@
+import math
+import re
+from typing import AsyncIterator, Iterator, NamedTuple, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableGenerator
+
+# "字数不超过 80 个字", "at most 80 characters", "no more than 80 words"
+_LENGTH_LIMIT = re.compile(
+    r"不超过\s*(\d+)\s*个?字|(?:at most|no more than)\s+(\d+)\s+(?:characters|words)",
+    re.IGNORECASE,
+)
+_SENTENCE_END = re.compile(r"[。！？!?\n]|\.(?=\s|$)")
+
+# Field names different chat model integrations use for the generation limit.
+_MAX_TOKENS_FIELDS = ("max_tokens", "max_output_tokens", "num_predict")
+
+
+class OutputBudget(NamedTuple):
+    # Streams are cut at the first sentence end after this many characters.
+    max_chars: int
+    # Hard generation limit enforced by the backend.
+    max_tokens: int
+
+
+def derive_output_budget(
+    template: str,
+    default_chars: int = 400,
+    slack: float = 2.0,
+    tokens_per_char: float = 1.5,
+    overhead_tokens: int = 32,
+) -> OutputBudget:
+    """Derive an output budget from the length limit a prompt asks for.
+
+    Models overshoot the requested length and citations add to it, so the
+    character budget is `slack` times the limit. Chinese text takes more
+    than one token per character, hence `tokens_per_char`.
+    """
+    match = _LENGTH_LIMIT.search(template)
+    limit = int(match.group(1) or match.group(2)) if match else None
+    max_chars = int(limit * slack) if limit else default_chars
+    max_tokens = math.ceil(max_chars * tokens_per_char) + overhead_tokens
+    return OutputBudget(max_chars=max_chars, max_tokens=max_tokens)
+
+
+def with_max_tokens(model: BaseChatModel, max_tokens: int) -> BaseChatModel:
+    """Copy of `model` that generates at most `max_tokens` tokens.
+
+    The copy shares the original's client and connection pool.
+    """
+    for field in _MAX_TOKENS_FIELDS:
+        if field in model.__fields__:
+            limited = model.copy(update={field: max_tokens})
+            # `copy()` leaves out excluded fields such as the client.
+            for name, value in model.__dict__.items():
+                limited.__dict__.setdefault(name, value)
+            return limited
+    raise ValueError(f"Cannot limit the output of {model.__class__.__name__}")
+
+
+class _Cutoff:
+    def __init__(self, max_chars: int, hard_limit: float):
+        self.max_chars = max_chars
+        self.hard_chars = int(max_chars * hard_limit)
+        self.emitted = 0
+        # The last chunk ended in "." after the budget, as in "3." or "e.g."
+        # split across chunks; it ends a sentence if whitespace follows.
+        self.pending_period = False
+
+    def feed(self, chunk: str) -> Tuple[str, bool]:
+        """Return the part of `chunk` to emit and whether to stop afterwards."""
+        if not chunk:
+            return chunk, False
+        if self.pending_period:
+            self.pending_period = False
+            if chunk[0].isspace():
+                return "", True
+        if self.emitted + len(chunk) <= self.max_chars:
+            self.emitted += len(chunk)
+            return chunk, False
+        match = _SENTENCE_END.search(chunk, max(0, self.max_chars - self.emitted))
+        if match is not None and not (
+            match.group() == "." and match.end() == len(chunk)
+        ):
+            return chunk[: match.end()], True
+        self.pending_period = match is not None
+        if self.emitted + len(chunk) >= self.hard_chars:
+            return chunk[: max(0, self.hard_chars - self.emitted)], True
+        self.emitted += len(chunk)
+        return chunk, False
+
+
+def sentence_cutoff(max_chars: int, hard_limit: float = 1.5) -> Runnable[str, str]:
+    """Stop a text stream at the first sentence end after `max_chars`.
+
+    A "." ends a sentence when whitespace or the end of the stream follows,
+    also when that is only in the next chunk. If no sentence ends, the
+    stream is cut at `hard_limit * max_chars`.
+    Stopping early closes the upstream stream, which ends the generation.
+    """
+
+    def cut(chunks: Iterator[str]) -> Iterator[str]:
+        cutoff = _Cutoff(max_chars, hard_limit)
+        for chunk in chunks:
+            text, done = cutoff.feed(chunk)
+            if text:
+                yield text
+            if done:
+                return
+
+    async def acut(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        cutoff = _Cutoff(max_chars, hard_limit)
+        async for chunk in chunks:
+            text, done = cutoff.feed(chunk)
+            if text:
+                yield text
+            if done:
+                return
+
+    return RunnableGenerator(cut, acut).with_config(run_name="SentenceCutoff")
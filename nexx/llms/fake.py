@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+import uuid
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+)
+from langchain_core.output_parsers.openai_tools import (
+    JsonOutputKeyToolsParser,
+    PydanticToolsParser,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import BaseModel
+from langchain_core.runnables import Runnable
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+WORDS = (
+    "LangChain retrieval chain vector store documents answer question context "
+    "model prompt token stream latency index embedding graph agent tool memory"
+).split()
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """Chat model with a deterministic answer and configurable timing.
+
+    The answer is `response_tokens` words picked from a hash of the last
+    message and `seed`, so the same prompt always gets the same answer. The
+    first token arrives after `ttft` seconds and the others at
+    `tokens_per_sec`. `jitter` adds up to that share of extra delay, drawn
+    from the same hash, so timings are reproducible as well. `max_tokens`
+    caps the answer like the limit of a real backend does.
+
+    With tools bound, a question is answered with a call of the first tool,
+    and with `format="json"` the answer is `json_response`, so the graders
+    and routers of the assistant graphs run against it as well.
+    """
+
+    ttft: float = 0.3
+    tokens_per_sec: float = 50.0
+    response_tokens: int = 60
+    jitter: float = 0.0
+    seed: int = 0
+    max_tokens: Optional[int] = None
+    format: Optional[str] = None
+    json_response: Dict[str, Any] = {"score": "yes", "datasource": "vectorstore"}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming-chat-model"
+
+    def _plan(self, messages: List[BaseMessage]) -> List[Tuple[str, float]]:
+        """The tokens of the answer, each with the delay before it."""
+        content = str(messages[-1].content) if messages else ""
+        digest = hashlib.sha1(f"{self.seed}\n{content}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+        count = self.response_tokens
+        if self.max_tokens is not None:
+            count = min(count, self.max_tokens)
+        interval = 1.0 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+        plan = []
+        for i in range(count):
+            token = rng.choice(WORDS) if i == 0 else f" {rng.choice(WORDS)}"
+            delay = self.ttft if i == 0 else interval
+            plan.append((token, delay * (1 + self.jitter * rng.random())))
+        return plan
+
+    def _answer(
+        self, messages: List[BaseMessage], **kwargs: Any
+    ) -> Optional[AIMessageChunk]:
+        """The whole answer when it is a tool call or JSON, else None."""
+        tools = kwargs.get("tools")
+        if tools and (
+            kwargs.get("tool_choice") or isinstance(messages[-1], HumanMessage)
+        ):
+            function = tools[0]["function"]
+            args = _example(function.get("parameters") or {})
+            return AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {
+                        "name": function["name"],
+                        "args": json.dumps(args),
+                        "id": f"call_{uuid.uuid4().hex[:24]}",
+                        "index": 0,
+                    }
+                ],
+            )
+        if self.format == "json":
+            return AIMessageChunk(content=json.dumps(self.json_response))
+        return None
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = list(self._stream(messages, stop, run_manager, **kwargs))
+        return _result(chunks)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = [
+            chunk
+            async for chunk in self._astream(messages, stop, run_manager, **kwargs)
+        ]
+        return _result(chunks)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        answer = self._answer(messages, **kwargs)
+        if answer is not None:
+            time.sleep(self.ttft)
+            yield ChatGenerationChunk(message=answer)
+            return
+        for token, delay in self._plan(messages):
+            time.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        answer = self._answer(messages, **kwargs)
+        if answer is not None:
+            await asyncio.sleep(self.ttft)
+            yield ChatGenerationChunk(message=answer)
+            return
+        for token, delay in self._plan(messages):
+            await asyncio.sleep(delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def bind_tools(
+        self, tools: Sequence[Union[Dict[str, Any], Type[BaseModel], Any]], **kwargs
+    ) -> Runnable:
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def with_structured_output(
+        self, schema: Union[Dict[str, Any], Type[BaseModel]], **kwargs: Any
+    ) -> Runnable:
+        name = convert_to_openai_tool(schema)["function"]["name"]
+        llm = self.bind_tools([schema], tool_choice=name)
+        if isinstance(schema, type) and issubclass(schema, BaseModel):
+            return llm | PydanticToolsParser(tools=[schema], first_tool_only=True)
+        return llm | JsonOutputKeyToolsParser(key_name=name, first_tool_only=True)
+
+
+def _example(schema: Dict[str, Any], definitions: Optional[Dict] = None) -> Any:
+    """A value matching a JSON schema, for fake tool call arguments."""
+    definitions = definitions or schema.get("definitions") or {}
+    if "$ref" in schema:
+        return _example(definitions[schema["$ref"].split("/")[-1]], definitions)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "allOf" in schema:
+        return _example(schema["allOf"][0], definitions)
+    kind = schema.get("type", "object")
+    if kind == "object":
+        return {
+            key: _example(value, definitions)
+            for key, value in (schema.get("properties") or {}).items()
+        }
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return True
+    return "yes"
+
+
+def _result(chunks: List[ChatGenerationChunk]) -> ChatResult:
+    message = AIMessageChunk(content="")
+    for chunk in chunks:
+        message += chunk.message
+    return ChatResult(
+        generations=[
+            ChatGeneration(
+                message=AIMessage(
+                    content=message.content,
+                    tool_calls=message.tool_calls,
+                    invalid_tool_calls=message.invalid_tool_calls,
+                )
+            )
+        ]
+    )
+
+
+def use_fake_llm() -> bool:
+    """Whether LLM_BACKEND=fake replaces the hosted models."""
+    return (os.environ.get("LLM_BACKEND") or "").lower() == "fake"
+
+
+def fake_chat_model_from_env(seed: int = 0, **kwargs: Any) -> FakeStreamingChatModel:
+    """Fake model timed by FAKE_LLM_TTFT, FAKE_LLM_TOKENS_PER_SEC and
+    FAKE_LLM_RESPONSE_TOKENS, unless given as keyword arguments."""
+    settings = {
+        "ttft": float(os.environ.get("FAKE_LLM_TTFT") or 0.3),
+        "tokens_per_sec": float(os.environ.get("FAKE_LLM_TOKENS_PER_SEC") or 50),
+        "response_tokens": int(os.environ.get("FAKE_LLM_RESPONSE_TOKENS") or 60),
+        "jitter": float(os.environ.get("FAKE_LLM_JITTER") or 0),
+    }
+    settings.update(kwargs)
+    return FakeStreamingChatModel(seed=seed, **settings)
@@ -0,0 +1,351 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Type
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import ahandle_event
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import patch_config
+from langchain_core.runnables.utils import (
+    ConfigurableFieldSpec,
+    Input,
+    Output,
+    get_unique_config_specs,
+)
+
+from nexx.llms.utils import aggregate_chunks
+
+
+class LatencyWindow:
+    """Rolling window of latency samples, in seconds."""
+
+    def __init__(self, maxlen: int = 200):
+        self._samples: deque = deque(maxlen=maxlen)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float) -> None:
+        self._samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+        return samples[index]
+
+
+class LatencyHedgedRunnable(Runnable[Input, Output]):
+    """Send a hedged request to a secondary model when the primary is slow.
+
+    The primary runnable is always started first. If it has not produced its
+    first chunk once the hedge delay has elapsed, the same input is sent to the
+    secondary runnable. Whichever stream yields its first chunk first wins and
+    the other one is cancelled.
+
+    The hedge delay is the `percentile` of recently observed primary
+    time-to-first-token, so only the slow tail of requests is duplicated.
+    Errors are not handled here, use `with_fallbacks` for that.
+    """
+
+    def __init__(
+        self,
+        primary: Runnable[Input, Output],
+        secondary: Runnable[Input, Output],
+        percentile: float = 0.95,
+        window_size: int = 200,
+        min_samples: int = 20,
+        initial_delay: float = 2.0,
+        min_delay: float = 0.05,
+    ):
+        self.primary = primary
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.primary_ttft = LatencyWindow(window_size)
+        self.hedged_requests = 0
+        self.secondary_wins = 0
+        # Requests hedge from several threads and event loops at once.
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def InputType(self) -> Type[Input]:
+        return self.primary.InputType
+
+    @property
+    def OutputType(self) -> Type[Output]:
+        return self.primary.OutputType
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return get_unique_config_specs(
+            spec
+            for step in (self.primary, self.secondary)
+            for spec in step.config_specs
+        )
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for the primary's first chunk before hedging."""
+        with self._lock:
+            if len(self.primary_ttft) < self.min_samples:
+                return self.initial_delay
+            return max(self.min_delay, self.primary_ttft.percentile(self.percentile))
+
+    def invoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    def stream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Output]:
+        yield from self._transform_stream_with_config(
+            iter([input]), self._transform, config, **kwargs
+        )
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async def input_aiter() -> AsyncIterator[Input]:
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(
+            input_aiter(), self._atransform, config, **kwargs
+        ):
+            yield chunk
+
+    def _invoke(self, input: Input, run_manager, config, **kwargs: Any) -> Output:
+        child_config = patch_config(config, callbacks=run_manager.get_child())
+        return aggregate_chunks(self._hedge(input, child_config, **kwargs))
+
+    async def _ainvoke(
+        self, input: Input, run_manager, config, **kwargs: Any
+    ) -> Output:
+        child_config = patch_config(config, callbacks=run_manager.get_child())
+        chunks = [chunk async for chunk in self._ahedge(input, child_config, **kwargs)]
+        return aggregate_chunks(chunks)
+
+    def _transform(
+        self, input: Iterator[Input], run_manager, config, **kwargs: Any
+    ) -> Iterator[Output]:
+        child_config = patch_config(config, callbacks=run_manager.get_child())
+        for final in input:
+            yield from self._hedge(final, child_config, **kwargs)
+
+    async def _atransform(
+        self, input: AsyncIterator[Input], run_manager, config, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        child_config = patch_config(config, callbacks=run_manager.get_child())
+        async for final in input:
+            async for chunk in self._ahedge(final, child_config, **kwargs):
+                yield chunk
+
+    def _record_hedge(self, winner: str, primary_elapsed: float) -> None:
+        # When the secondary wins the primary's TTFT is only known to be at
+        # least `primary_elapsed`, which still pushes the percentile upwards.
+        with self._lock:
+            self.primary_ttft.add(primary_elapsed)
+            if winner == "secondary":
+                self.secondary_wins += 1
+
+    def _count_hedged(self) -> None:
+        with self._lock:
+            self.hedged_requests += 1
+
+    def _hedge(
+        self, input: Input, config: RunnableConfig, **kwargs: Any
+    ) -> Iterator[Output]:
+        """Run `_ahedge` on the background loop and relay its chunks.
+
+        A stream blocked in a thread cannot be stopped before its next
+        chunk, so a losing request would keep waiting for its first token.
+        Cancelling it on the loop closes its response right away.
+        """
+        events: queue.Queue = queue.Queue()
+
+        async def produce() -> None:
+            try:
+                async for chunk in self._ahedge(input, config, **kwargs):
+                    events.put(("chunk", chunk))
+                events.put(("done", None))
+            except BaseException as e:
+                events.put(("error", e))
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self._background_loop())
+        try:
+            while True:
+                kind, payload = events.get()
+                if kind == "error":
+                    raise payload
+                if kind == "done":
+                    return
+                yield payload
+        finally:
+            # The caller stopped early: cancel the winning stream as well.
+            future.cancel()
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the loop that serves every sync hedge of this runnable.
+
+        Async HTTP clients stay bound to the loop that first used them, so
+        the loop lives as long as the runnable instead of one call.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever,
+                    name="latency-hedge",
+                    daemon=True,
+                ).start()
+            return self._loop
+
+    async def _ahedge(
+        self, input: Input, config: RunnableConfig, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        start = time.monotonic()
+        runs = {"primary": _OpenRuns(), "secondary": _OpenRuns()}
+
+        def open_stream(name: str, runnable: Runnable) -> AsyncIterator[Output]:
+            callbacks = config["callbacks"].copy()
+            callbacks.add_handler(runs[name])
+            return runnable.astream(
+                input, patch_config(config, callbacks=callbacks), **kwargs
+            )
+
+        streams = {"primary": open_stream("primary", self.primary)}
+        tasks = {"primary": asyncio.ensure_future(_anext(streams["primary"]))}
+        done, _ = await asyncio.wait(tasks.values(), timeout=self.hedge_delay())
+        if not done:
+            self._count_hedged()
+            streams["secondary"] = open_stream("secondary", self.secondary)
+            tasks["secondary"] = asyncio.ensure_future(_anext(streams["secondary"]))
+
+        winner: Optional[str] = None
+        first: Tuple[bool, Any] = (False, None)
+        try:
+            pending = set(tasks.values())
+            while winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for name, task in tasks.items():
+                    if task not in done:
+                        continue
+                    # Skip over a failed stream as long as the other one is
+                    # still running.
+                    if task.exception() is not None and pending:
+                        continue
+                    winner = name
+                    first = task.result()
+                    break
+            self._record_hedge(winner, time.monotonic() - start)
+        finally:
+            for name, task in tasks.items():
+                if name != winner:
+                    task.cancel()
+                    await _aclose(streams[name], task)
+                    await runs[name].close(config["callbacks"].handlers)
+
+        has_chunk, chunk = first
+        if not has_chunk:
+            return
+        yield chunk
+        async for chunk in streams[winner]:
+            yield chunk
+
+
+# Start event -> (error event, ignore flag) of the runs `_OpenRuns` tracks.
+_RUN_EVENTS = {
+    "on_chain_start": ("on_chain_error", "ignore_chain"),
+    "on_chat_model_start": ("on_llm_error", "ignore_llm"),
+    "on_llm_start": ("on_llm_error", "ignore_llm"),
+    "on_retriever_start": ("on_retriever_error", "ignore_retriever"),
+    "on_tool_start": ("on_tool_error", "ignore_agent"),
+}
+
+
+class _OpenRuns(BaseCallbackHandler):
+    """The runs of one hedged stream that have started and not ended yet.
+
+    LangChain awaits a run's start callbacks before it guards the run with
+    its error callback, so a losing stream cancelled while a model call
+    starts leaves that run open in every handler. `close` ends such runs.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        # Run id -> (error event, ignore flag, parent run id), in start order.
+        self.runs: Dict[UUID, Tuple[str, str, Optional[UUID]]] = {}
+
+    def _end(self, *args: Any, run_id: UUID, **kwargs: Any) -> None:
+        self.runs.pop(run_id, None)
+
+    on_chain_end = on_chain_error = _end
+    on_llm_end = on_llm_error = _end
+    on_retriever_end = on_retriever_error = _end
+    on_tool_end = on_tool_error = _end
+
+    async def close(self, handlers: List[BaseCallbackHandler]) -> None:
+        """Report the open runs as cancelled, innermost first."""
+        for run_id, (event, ignore, parent_run_id) in reversed(list(self.runs.items())):
+            await ahandle_event(
+                handlers,
+                event,
+                ignore,
+                asyncio.CancelledError(),
+                run_id=run_id,
+                parent_run_id=parent_run_id,
+            )
+        self.runs.clear()
+
+
+def _open_runs_method(event: str) -> Any:
+    def start(
+        self: _OpenRuns,
+        *args: Any,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self.runs[run_id] = (*_RUN_EVENTS[event], parent_run_id)
+
+    return start
+
+
+for _event in _RUN_EVENTS:
+    setattr(_OpenRuns, _event, _open_runs_method(_event))
+
+
+async def _anext(iterator: AsyncIterator) -> Tuple[bool, Any]:
+    try:
+        return True, await iterator.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def _aclose(iterator: AsyncIterator, task: asyncio.Future) -> None:
+    try:
+        await task
+    except BaseException:
+        pass
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except BaseException:
+            pass
@@ -0,0 +1,309 @@
+import copy
+import logging
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Type
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ensure_config, patch_config
+from langchain_core.runnables.utils import (
+    ConfigurableFieldSpec,
+    Input,
+    Output,
+    get_unique_config_specs,
+)
+
+from nexx.llms.utils import aggregate_chunks
+
+logger = logging.getLogger(__name__)
+
+AUTO = "auto"
+
+
+class BackendStats:
+    """Rolling latency and error statistics of a single backend."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.ttft: Optional[float] = None
+        self.tokens_per_sec: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.unhealthy_until = 0.0
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return self.alpha * value + (1 - self.alpha) * current
+
+    def record_success(self, ttft: float, tokens: int, duration: float) -> None:
+        self.requests += 1
+        self.consecutive_errors = 0
+        self.error_rate = self._ewma(self.error_rate, 0.0)
+        self.ttft = self._ewma(self.ttft, ttft)
+        if tokens > 1 and duration > 0:
+            self.tokens_per_sec = self._ewma(self.tokens_per_sec, tokens / duration)
+
+    def record_error(self) -> None:
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_errors += 1
+        self.error_rate = self._ewma(self.error_rate, 1.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ttft": self.ttft,
+            "tokens_per_sec": self.tokens_per_sec,
+            "error_rate": self.error_rate,
+            "requests": self.requests,
+            "errors": self.errors,
+            "consecutive_errors": self.consecutive_errors,
+            "healthy": self.unhealthy_until <= time.time(),
+        }
+
+
+class LatencyRouter(Runnable[Input, Output]):
+    """Route each request to the currently fastest healthy backend.
+
+    Clients can still pin a backend with `{"configurable": {"llm": <key>}}`,
+    or with one of the `aliases` of its key.
+    Otherwise (`"auto"`, the default) the backend with the lowest expected
+    latency, `ttft + expected_tokens / tokens_per_sec`, is picked among the
+    healthy ones. Backends without samples yet are tried first, and a small
+    share of traffic explores other backends so their statistics stay fresh.
+
+    A backend becomes unhealthy for `cooldown` seconds after
+    `max_consecutive_errors` failures in a row, or when its error rate EWMA
+    exceeds `max_error_rate`.
+    """
+
+    def __init__(
+        self,
+        backends: Dict[str, Runnable[Input, Output]],
+        default_key: str,
+        alpha: float = 0.2,
+        expected_tokens: int = 200,
+        explore_rate: float = 0.05,
+        max_consecutive_errors: int = 3,
+        max_error_rate: float = 0.5,
+        cooldown: float = 30.0,
+        aliases: Optional[Dict[str, str]] = None,
+    ):
+        self.backends = backends
+        self.default_key = default_key
+        self.aliases = aliases or {}
+        self.expected_tokens = expected_tokens
+        self.explore_rate = explore_rate
+        self.max_consecutive_errors = max_consecutive_errors
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._stats = {key: BackendStats(alpha) for key in backends}
+        self._lock = threading.Lock()
+
+    @property
+    def InputType(self) -> Type[Input]:
+        return self.backends[self.default_key].InputType
+
+    @property
+    def OutputType(self) -> Type[Output]:
+        return self.backends[self.default_key].OutputType
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return get_unique_config_specs(
+            [
+                ConfigurableFieldSpec(
+                    id="llm",
+                    name="LLM",
+                    description=(
+                        "Backend to use, one of "
+                        f"{', '.join([AUTO, *self.backends])}. "
+                        f"'{AUTO}' routes to the fastest healthy backend."
+                    ),
+                    annotation=str,
+                    default=AUTO,
+                )
+            ]
+            + [
+                spec
+                for backend in self.backends.values()
+                for spec in backend.config_specs
+            ]
+        )
+
+    def with_backends(
+        self, backends: Dict[str, Runnable[Input, Output]]
+    ) -> "LatencyRouter[Input, Output]":
+        """Router over other instances of the same backends, e.g. copies with
+        different generation limits, that shares this router's statistics."""
+        if set(backends) != set(self.backends):
+            raise ValueError(f"Expected backends {sorted(self.backends)}")
+        router = copy.copy(self)
+        router.backends = backends
+        return router
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {key: stats.to_dict() for key, stats in self._stats.items()}
+
+    def _expected_latency(self, stats: BackendStats) -> float:
+        if stats.ttft is None:
+            # Untried backends go first, backends that only ever failed last.
+            return 0.0 if not stats.errors else float("inf")
+        latency = stats.ttft
+        if stats.tokens_per_sec:
+            latency += self.expected_tokens / stats.tokens_per_sec
+        # Each failed attempt costs roughly another round trip.
+        return latency / max(1.0 - stats.error_rate, 0.1)
+
+    def select(self, config: Optional[RunnableConfig] = None) -> str:
+        """Pick the backend key for a request."""
+        key = ensure_config(config).get("configurable", {}).get("llm", AUTO)
+        key = self.aliases.get(key, key)
+        if key in self.backends:
+            return key
+        if key != AUTO:
+            logger.warning(f"Unknown llm {key!r}, routing automatically")
+
+        now = time.time()
+        with self._lock:
+            healthy = [
+                key
+                for key, stats in self._stats.items()
+                if stats.unhealthy_until <= now
+            ]
+            if not healthy:
+                return self.default_key
+            if len(healthy) > 1 and random.random() < self.explore_rate:
+                return random.choice(healthy)
+            return min(
+                healthy,
+                key=lambda key: (
+                    self._expected_latency(self._stats[key]),
+                    key != self.default_key,
+                ),
+            )
+
+    def _record_success(
+        self, key: str, start: float, first: Optional[float], tokens: int
+    ) -> None:
+        end = time.monotonic()
+        first = end if first is None else first
+        with self._lock:
+            self._stats[key].record_success(first - start, tokens, end - first)
+
+    def _record_error(self, key: str) -> None:
+        with self._lock:
+            stats = self._stats[key]
+            stats.record_error()
+            if (
+                stats.consecutive_errors >= self.max_consecutive_errors
+                or stats.error_rate > self.max_error_rate
+            ):
+                stats.unhealthy_until = time.time() + self.cooldown
+                logger.warning(f"Backend {key} marked unhealthy for {self.cooldown}s")
+
+    def invoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return self._call_with_config(self._invoke, input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return await self._acall_with_config(self._ainvoke, input, config, **kwargs)
+
+    def stream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Output]:
+        yield from self._transform_stream_with_config(
+            iter([input]), self._transform, config, **kwargs
+        )
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async def input_aiter() -> AsyncIterator[Input]:
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(
+            input_aiter(), self._atransform, config, **kwargs
+        ):
+            yield chunk
+
+    def _invoke(self, input: Input, run_manager, config, **kwargs: Any) -> Output:
+        return aggregate_chunks(self._route(input, run_manager, config, **kwargs))
+
+    async def _ainvoke(
+        self, input: Input, run_manager, config, **kwargs: Any
+    ) -> Output:
+        return aggregate_chunks(
+            [
+                chunk
+                async for chunk in self._aroute(input, run_manager, config, **kwargs)
+            ]
+        )
+
+    def _transform(
+        self, input: Iterator[Input], run_manager, config, **kwargs: Any
+    ) -> Iterator[Output]:
+        for final in input:
+            yield from self._route(final, run_manager, config, **kwargs)
+
+    async def _atransform(
+        self, input: AsyncIterator[Input], run_manager, config, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async for final in input:
+            async for chunk in self._aroute(final, run_manager, config, **kwargs):
+                yield chunk
+
+    def _route(
+        self, input: Input, run_manager, config, **kwargs: Any
+    ) -> Iterator[Output]:
+        key = self.select(config)
+        backend = self.backends[key]
+        child_config = patch_config(config, callbacks=run_manager.get_child(key))
+        start, first, tokens = time.monotonic(), None, 0
+        try:
+            for chunk in backend.stream(input, child_config, **kwargs):
+                if first is None:
+                    first = time.monotonic()
+                tokens += 1
+                yield chunk
+        except Exception:
+            self._record_error(key)
+            raise
+        except BaseException:
+            # Cancelled, e.g. by a hedge that answered first. The time waited
+            # for the first chunk is still a lower bound of the backend's TTFT.
+            if first is None:
+                self._record_success(key, start, first, tokens)
+            raise
+        self._record_success(key, start, first, tokens)
+
+    async def _aroute(
+        self, input: Input, run_manager, config, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        key = self.select(config)
+        backend = self.backends[key]
+        child_config = patch_config(config, callbacks=run_manager.get_child(key))
+        start, first, tokens = time.monotonic(), None, 0
+        try:
+            async for chunk in backend.astream(input, child_config, **kwargs):
+                if first is None:
+                    first = time.monotonic()
+                tokens += 1
+                yield chunk
+        except Exception:
+            self._record_error(key)
+            raise
+        except BaseException:
+            # Cancelled, e.g. by a hedge that answered first. The time waited
+            # for the first chunk is still a lower bound of the backend's TTFT.
+            if first is None:
+                self._record_success(key, start, first, tokens)
+            raise
+        self._record_success(key, start, first, tokens)
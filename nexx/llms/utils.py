@@ -0,0 +1,15 @@
+from typing import Any, Iterable
+
+
+def aggregate_chunks(chunks: Iterable[Any]) -> Any:
+    """Add up streamed chunks the way `Runnable.stream` consumers do."""
+    final = None
+    for chunk in chunks:
+        if final is None:
+            final = chunk
+        else:
+            try:
+                final = final + chunk
+            except TypeError:
+                final = chunk
+    return final
@@ -5,7 +5,7 @@ from bs4 import BeautifulSoup, SoupStrainer
 from langchain.utils.html import PREFIXES_TO_IGNORE_REGEX, SUFFIXES_TO_IGNORE_REGEX
 from langchain_community.document_loaders import RecursiveUrlLoader, SitemapLoader
 
-from future.parsers.langchain_parser import langchain_docs_parser, langsmith_docs_parser
+from nexx.parsers.langchain_parser import langchain_docs_parser, langsmith_docs_parser
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -1,7 +1,9 @@
+import os
 from typing import List, Union
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.schema import AIMessage, HumanMessage, SystemMessage
 from langchain_community.chat_models.zhipuai import ChatZhipuAI
@@ -9,8 +11,16 @@ from langchain_core.pydantic_v1 import BaseModel, Field
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langserve import add_routes
 
-from nexx.chains.langchain_chain import ChatInput, answer_chain
+from nexx.chains.langchain_chain import ChatInput, answer_chain, llm_router, retriever
+from nexx.llms.fake import fake_chat_model_from_env, use_fake_llm
 from nexx.my_secrets import GOOGLE_API_KEY, ZHIPU_API_KEY
+from nexx.observability.callbacks import MetricsCallbackHandler
+from nexx.observability.metrics import REGISTRY
+from nexx.observability.tracing import get_tracer
+from nexx.retrievers.filtered import UnknownFilterFieldError
+from nexx.server.admission import AdmissionControlMiddleware, AdmissionQueue
+from nexx.server.sessions import SessionHistoryRunnable, SessionStore
+from nexx.server.singleflight import SingleflightRunnable
 
 app = FastAPI(
     title="LangChain Server",
@@ -18,6 +28,25 @@ app = FastAPI(
     description="A simple api server using Langchain's Runnable interfaces",
 )
 
+# Bound the concurrent chain runs per route, so bursts queue up (interactive
+# requests ahead of `X-Priority: batch` ones) or are rejected fast instead of
+# slowing every request down. Added before CORS so rejections get its headers.
+app.add_middleware(
+    AdmissionControlMiddleware,
+    queues={
+        "/chat/langchain": AdmissionQueue(
+            "/chat/langchain",
+            max_concurrency=int(os.environ.get("LANGCHAIN_MAX_CONCURRENCY") or 16),
+            max_queue_time=float(os.environ.get("LANGCHAIN_MAX_QUEUE_TIME") or 10),
+        ),
+        "/chat/glm": AdmissionQueue(
+            "/chat/glm",
+            max_concurrency=int(os.environ.get("GLM_MAX_CONCURRENCY") or 8),
+            max_queue_time=float(os.environ.get("GLM_MAX_QUEUE_TIME") or 10),
+        ),
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -27,18 +56,82 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Clients send a `session_id` and only the new question, the conversation so
+# far is kept here.
+session_store = SessionStore()
+
+langchain_chain = SessionHistoryRunnable(
+    # Identical concurrent requests share one execution of the chain.
+    SingleflightRunnable(answer_chain, name="langchain"),
+    session_store,
+).with_types(input_type=ChatInput)
+
+
+async def validate_filters(config: dict, request: Request) -> dict:
+    """Reject unknown filter fields with a 422 before the response starts.
+
+    A bad filter is the client's mistake, and once a stream has started,
+    LangServe can only report errors as a 500 event, so the filters are
+    checked when the request comes in.
+    """
+    if request.method != "POST":
+        return config
+    body = await request.json()
+    inputs = body.get("inputs") or [body.get("input")]
+    for input in inputs:
+        if isinstance(input, dict):
+            try:
+                retriever.validate_filters(input.get("filters"))
+            except UnknownFilterFieldError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+    return config
+
+
 add_routes(
     app,
-    answer_chain.with_types(input_type=ChatInput),
+    # Stage latencies, TTFT and token rates for /metrics, and local traces.
+    langchain_chain.with_config(callbacks=[MetricsCallbackHandler(), get_tracer()]),
     path="/chat/langchain",
     config_keys=["metadata", "configurable", "tags"],
+    per_req_config_modifier=validate_filters,
 )
 
-chat_glm = ChatZhipuAI(
-    model="glm-4",
-    temperature=0.5,
-    api_key=ZHIPU_API_KEY,
-)
+
+@app.get("/chat/langchain/llm_stats")
+async def llm_stats():
+    """Rolling latency and error statistics of each LLM backend."""
+    return llm_router.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """All metrics in the Prometheus text format."""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/traces")
+async def traces(limit: int = 50):
+    """The latest sampled, slow or failed traces, newest first."""
+    return get_tracer().recent(limit)
+
+
+@app.delete("/chat/langchain/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """Forget the stored conversation of a session."""
+    session_store.delete(session_id)
+    return {"session_id": session_id}
+
+
+if use_fake_llm():
+    chat_glm = fake_chat_model_from_env(seed=3)
+else:
+    chat_glm = ChatZhipuAI(
+        model="glm-4",
+        temperature=0.5,
+        api_key=ZHIPU_API_KEY,
+    )
 
 add_routes(app, chat_glm, path="/chat/glm", playground_type="chat")
 
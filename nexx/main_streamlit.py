@@ -1,84 +1,50 @@
-import json
 import uuid
 
-import requests
+import httpx
 import streamlit as st
 
+from nexx.clients.coalesce import coalesce
+from nexx.clients.events import event_content
+from nexx.clients.http import StreamingClient
+from nexx.clients.sse import iter_events
+from nexx.clients.transcript import Transcript
 
-def handle_response_line(line):
-    """处理响应中的每一行数据"""
-    decoded_line = line.decode("utf-8")
-    if decoded_line.startswith("data: "):
-        return handle_data_line(decoded_line)
-    elif decoded_line.startswith("event: ") or ": ping" in decoded_line:
-        return None  # 忽略事件和ping消息
-    else:
-        return f"{decoded_line}"  # 对于普通文本行，添加换行符
-
-
-def handle_data_line(decoded_line):
-    """处理以'data: '开头的行"""
-    json_data = decoded_line[len("data: ") :]
-    try:
-        data = json.loads(json_data)
-        return process_event_data(data)
-    except json.JSONDecodeError as e:
-        return f"JSON decoding error: {e}\n\n"
-
-
-def process_event_data(data):
-    """处理事件数据"""
-    if "event" in data:
-        return handle_event(data)
-    elif "content" in data or "steps" in data or "output" in data:
-        return f"{data.get('content') or data.get('steps') or data.get('output')}\n"
-
-
-def handle_event(data):
-    """处理特定的事件类型"""
-    kind = data["event"]
-    if kind == "on_chat_model_stream":
-        return (
-            data["data"]["chunk"]["content"]
-            if data["data"]["chunk"]["content"]
-            else None
-        )
-    elif kind == "on_tool_start":
-        return handle_tool_start(data)
-    elif kind == "on_tool_end":
-        return "Search completed.\n"
-
-
-def handle_tool_start(data):
-    """处理工具开始事件"""
-    tool_inputs = data["data"].get("input")
-    inputs_str = (
-        ", ".join(f"'{v}'" for k, v in tool_inputs.items())
-        if isinstance(tool_inputs, dict)
-        else str(tool_inputs)
-    )
-    return f"Searching Tool: {data['name']} with input: {inputs_str} ⏳\n"
+RENDER_INTERVAL = 0.05
 
 
-def consume_api(url, user_query, session_id):
-    """使用requests POST与FastAPI后端通信，支持流式传输。"""
-    headers = {"Content-Type": "application/json"}
-    config = {"session_id": session_id}
-    payload = {"input": user_query, "config": config}
+@st.cache_resource
+def get_http_client():
+    """所有 Streamlit 会话共用一个连接池和后台线程，避免每轮对话重新建立 TCP/TLS 连接，
+    也不会随会话数量泄漏线程和连接"""
+    return StreamingClient(max_connections=100)
 
-    with requests.post(url, json=payload, headers=headers, stream=True) as response:
+
+def stream_contents(url, payload):
+    """以流式方式 POST 请求，逐个解析 SSE 事件并产出合并后的内容"""
+    # 在脚本线程里取出连接池，合并阶段会在后台线程读取这个生成器
+    client = get_http_client()
+
+    def contents():
         try:
-            response.raise_for_status()
-            for line in response.iter_lines():
-                if line:
-                    content = handle_response_line(line)
-                    if content:
-                        yield content
-        except requests.exceptions.HTTPError as err:
+            for event in iter_events(client, "POST", url, json=payload):
+                content = event_content(event)
+                if content:
+                    yield content
+        except httpx.HTTPStatusError as err:
             yield f"HTTP Error: {err}\n\n"
         except Exception as e:
             yield f"An error occurred: {e}\n\n"
 
+    # 每 50ms 刷新一次界面，而不是每个 token 都重新渲染
+    return coalesce(contents(), interval=RENDER_INTERVAL)
+
+
+def consume_api(url, user_query, session_id):
+    """与FastAPI后端通信，支持流式传输。"""
+    config = {"session_id": session_id}
+    payload = {"input": user_query, "config": config}
+    return stream_contents(url, payload)
+
 
 def call_gemini(message, session_id):
     return consume_api(
@@ -97,25 +63,11 @@ def call_chatglm(message, session_id):
 
 
 def call_chat_langchain(message, session_id):
-    url = f"http://0.0.0.0:8001/chat/langchain/invoke"
-    session_id = (session_id,)
-
-    headers = {"Content-Type": "application/json"}
-    config = {"session_id": session_id}
-    payload = {"input": {"question": message}, "config": config}
+    url = f"http://0.0.0.0:8001/chat/langchain/stream"
 
-    with requests.post(url, json=payload, headers=headers, stream=True) as response:
-        try:
-            response.raise_for_status()
-            for line in response.iter_lines():
-                if line:
-                    content = handle_response_line(line)
-                    if content:
-                        yield content
-        except requests.exceptions.HTTPError as err:
-            yield f"HTTP Error: {err}\n\n"
-        except Exception as e:
-            yield f"An error occurred: {e}\n\n"
+    # 服务端按 session_id 保存对话历史，这里只发送新的问题
+    payload = {"input": {"question": message, "session_id": session_id}}
+    return stream_contents(url, payload)
 
 
 st.title("🚀 问霸霸")
@@ -145,14 +97,22 @@ option = "glm-4"
 
 
 if "messages" not in st.session_state:
-    st.session_state["messages"] = [
+    # 只有最近的消息会在每次 rerun 时渲染，更早的消息压缩成分段保存
+    st.session_state["messages"] = Transcript()
+    st.session_state.messages.append(
         {"role": "assistant", "content": "How can I help you today?"}
-    ]
+    )
 
 if "session_id" not in st.session_state:
     st.session_state["session_id"] = str(uuid.uuid4())
 
-for msg in st.session_state.messages:
+for i in range(len(st.session_state.messages.segments)):
+    first, last = st.session_state.messages.segment_range(i)
+    # 折叠的分段只有展开时才解压和渲染
+    if st.toggle(f"显示第 {first}–{last} 条消息", key=f"segment_{i}"):
+        for msg in st.session_state.messages.segment(i):
+            st.chat_message(msg["role"]).write(msg["content"])
+for msg in st.session_state.messages.recent_messages():
     st.chat_message(msg["role"]).write(msg["content"])
 if prompt := st.chat_input(key=st.session_state.session_id):
     st.session_state.messages.append({"role": "user", "content": prompt})
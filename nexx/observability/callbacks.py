@@ -0,0 +1,226 @@
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from nexx.observability.metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("CondenseQuestion", "FindDocs", "RetrieveDocs", "GenerateResponse")
+
+# Metadata flag of the callback events a request that joined a shared
+# execution late gets replayed (see nexx.server.singleflight). They arrive
+# back to back, so their timings say nothing about the execution.
+REPLAYED = "singleflight_replay"
+
+STAGE_SECONDS = Histogram(
+    "chain_stage_seconds",
+    "Duration of named chain stages, and of whole requests as stage 'total'.",
+    ["stage", "status"],
+)
+STAGE_IN_FLIGHT = Gauge(
+    "chain_stage_in_flight",
+    "Named chain stages currently running, and requests as stage 'total'.",
+    ["stage"],
+)
+LLM_TTFT_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from the start of an LLM call to its first streamed token.",
+    ["model"],
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second",
+    "Streaming rate of LLM calls after their first token.",
+    ["model"],
+    buckets=(1, 5, 10, 20, 40, 60, 80, 100, 150, 200, 400),
+)
+LLM_IN_FLIGHT = Gauge(
+    "llm_in_flight",
+    "LLM calls currently running.",
+    ["model"],
+)
+
+
+def is_replayed(kwargs: Dict[str, Any]) -> bool:
+    """Whether the kwargs of a start event mark it as replayed."""
+    return bool((kwargs.get("metadata") or {}).get(REPLAYED))
+
+
+def _model_name(serialized: Dict[str, Any], kwargs: Dict[str, Any]) -> str:
+    params = kwargs.get("invocation_params") or {}
+    return str(
+        params.get("model")
+        or params.get("model_name")
+        or (serialized.get("kwargs") or {}).get("model")
+        or kwargs.get("name")
+        or (serialized.get("id") or ["unknown"])[-1]
+    )
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Record stage latencies and LLM streaming metrics.
+
+    Chain and retriever runs whose name is in `stages` are timed, and so are
+    root runs, under the stage `total`. Every LLM call records its
+    time-to-first-token and the token rate after it, counting streamed
+    chunks as tokens. Replayed runs are skipped. Runs are tracked in a dict
+    keyed on their run id, and the handler runs inline, so it costs a few
+    dict operations per event.
+
+    Runs that never end, such as those of a client that disconnected, leave
+    the in-flight gauges after `run_ttl` seconds.
+    """
+
+    run_inline = True
+
+    def __init__(self, stages: Sequence[str] = STAGES, run_ttl: float = 600.0):
+        self.stages = frozenset(stages)
+        self.run_ttl = run_ttl
+        self._last_expiry = time.monotonic()
+        self._runs: Dict[UUID, Tuple[str, float]] = {}
+        # Run id -> (model, start, first token time, tokens).
+        self._llm_runs: Dict[UUID, List] = {}
+
+    def _expire(self) -> None:
+        """Forget the runs that have been open for longer than `run_ttl`."""
+        cutoff = time.monotonic() - self.run_ttl
+        expired = 0
+        for run_id, (stage, start) in list(self._runs.items()):
+            if start < cutoff and self._runs.pop(run_id, None) is not None:
+                STAGE_IN_FLIGHT.dec(stage=stage)
+                expired += 1
+        for run_id, run in list(self._llm_runs.items()):
+            if run[1] < cutoff and self._llm_runs.pop(run_id, None) is not None:
+                LLM_IN_FLIGHT.dec(model=run[0])
+                expired += 1
+        if expired:
+            logger.warning(f"Dropped {expired} runs that never ended")
+
+    def _start_run(
+        self, run_id: UUID, parent_run_id: Optional[UUID], name: Optional[str]
+    ) -> None:
+        if parent_run_id is None:
+            now = time.monotonic()
+            if now - self._last_expiry > min(self.run_ttl, 60.0):
+                self._last_expiry = now
+                self._expire()
+            stage = "total"
+        elif name in self.stages:
+            stage = name
+        else:
+            return
+        self._runs[run_id] = (stage, time.monotonic())
+        STAGE_IN_FLIGHT.inc(stage=stage)
+
+    def _end_run(self, run_id: UUID, status: str) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, start = run
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(time.monotonic() - start, stage=stage, status=status)
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if is_replayed(kwargs):
+            return
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        self._start_run(run_id, parent_run_id, name)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_run(run_id, "ok")
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end_run(run_id, "error")
+
+    def on_retriever_start(
+        self,
+        serialized: Dict[str, Any],
+        query: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        if is_replayed(kwargs):
+            return
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        self._start_run(run_id, parent_run_id, name)
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_run(run_id, "ok")
+
+    def on_retriever_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end_run(run_id, "error")
+
+    def _start_llm(
+        self, serialized: Dict[str, Any], run_id: UUID, kwargs: Dict[str, Any]
+    ) -> None:
+        if is_replayed(kwargs):
+            return
+        model = _model_name(serialized or {}, kwargs)
+        self._llm_runs[run_id] = [model, time.monotonic(), None, 0]
+        LLM_IN_FLIGHT.inc(model=model)
+
+    def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: List[str],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        self._start_llm(serialized, run_id, kwargs)
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        self._start_llm(serialized, run_id, kwargs)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._llm_runs.get(run_id)
+        if run is None:
+            return
+        if run[2] is None:
+            run[2] = time.monotonic()
+            LLM_TTFT_SECONDS.observe(run[2] - run[1], model=run[0])
+        run[3] += 1
+
+    def _end_llm(self, run_id: UUID) -> None:
+        run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+        model, _, first_token, tokens = run
+        LLM_IN_FLIGHT.dec(model=model)
+        if first_token is not None and tokens > 1:
+            duration = time.monotonic() - first_token
+            if duration > 0:
+                LLM_TOKENS_PER_SECOND.observe((tokens - 1) / duration, model=model)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_llm(run_id)
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end_llm(run_id)
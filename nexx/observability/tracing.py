@@ -0,0 +1,401 @@
+"""Local span tracing for chain and graph runs, without network calls."""
+
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.utils.env import env_var_is_set
+
+from nexx.observability.callbacks import is_replayed
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = os.environ.get(
+    "TRACE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "nexx", "traces")
+)
+
+# Variables with which LangChain sends every run to LangSmith.
+LANGSMITH_TRACING_VARS = (
+    "LANGCHAIN_TRACING_V2",
+    "LANGSMITH_TRACING",
+    "LANGSMITH_TRACING_V2",
+    "LANGCHAIN_TRACING",
+)
+
+
+def disable_langsmith_tracing() -> None:
+    """Turn off LangChain's LangSmith tracing set up in the environment."""
+    for name in LANGSMITH_TRACING_VARS:
+        if env_var_is_set(name):
+            logger.info(f"Local tracing is on, ignoring {name}")
+            os.environ[name] = "false"
+
+
+class JsonlSink:
+    """Append traces to a JSONL file, rotated once it reaches `max_bytes`.
+
+    `traces.jsonl` is renamed to `traces.jsonl.1` and so on, and only
+    `backup_count` old files are kept.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join(TRACE_DIR, "traces.jsonl"),
+        max_bytes: int = 50 * 1024 * 1024,
+        backup_count: int = 5,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _rotate(self) -> None:
+        for i in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def write(self, traces: List[Dict[str, Any]]) -> None:
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            for trace in traces:
+                f.write(json.dumps(trace, ensure_ascii=False, default=str) + "\n")
+
+
+class SqliteSink:
+    """Store traces in SQLite, keeping only the latest `max_traces`."""
+
+    def __init__(
+        self,
+        path: str = os.path.join(TRACE_DIR, "traces.sqlite3"),
+        max_traces: int = 100_000,
+    ):
+        self.path = path
+        self.max_traces = max_traces
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Only the tracer's writer thread uses the connection.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS traces ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, trace_id TEXT, name TEXT, "
+            "start REAL, duration REAL, status TEXT, retained TEXT, spans TEXT)"
+        )
+
+    def write(self, traces: List[Dict[str, Any]]) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO traces "
+                "(trace_id, name, start, duration, status, retained, spans) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        trace["trace_id"],
+                        trace["name"],
+                        trace["start"],
+                        trace["duration"],
+                        trace["status"],
+                        trace["retained"],
+                        json.dumps(trace["spans"], ensure_ascii=False, default=str),
+                    )
+                    for trace in traces
+                ],
+            )
+            self._conn.execute(
+                "DELETE FROM traces WHERE id <= (SELECT MAX(id) FROM traces) - ?",
+                (self.max_traces,),
+            )
+
+
+class _Trace:
+    __slots__ = ("trace_id", "sampled", "spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List[Dict[str, Any]] = []
+
+
+class LocalTracer(BaseCallbackHandler):
+    """Record span trees of chain and graph runs locally.
+
+    Every root run starts a trace, and each chain, retriever, LLM and tool
+    run inside it becomes a span with its parent, name, timings and error.
+    Inputs and outputs are not recorded, which keeps the overhead at a few
+    dict operations per event.
+
+    Whether a trace is kept is decided when it ends: sampled traces
+    (`sample_rate`, decided up front) are kept, and so are traces that took
+    at least `slow_threshold` seconds or failed, whatever the sample rate.
+    Kept traces go into an in-memory ring buffer of `buffer_size` traces and
+    are written to `sink` by a background thread.
+
+    Runs that never end, such as those of a stream abandoned without
+    closing it, are forgotten `span_ttl` seconds after they started.
+    """
+
+    run_inline = True
+
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        slow_threshold: Optional[float] = 10.0,
+        buffer_size: int = 1000,
+        sink: Optional[Any] = None,
+        span_ttl: float = 3600.0,
+    ):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.sink = sink
+        self.span_ttl = span_ttl
+        self._last_expiry = time.monotonic()
+        self.buffer: deque = deque(maxlen=buffer_size)
+        self._traces: Dict[UUID, _Trace] = {}
+        self._spans: Dict[UUID, Dict[str, Any]] = {}
+        self._queue: queue.Queue = queue.Queue(maxsize=10_000)
+        if sink is not None:
+            threading.Thread(target=self._write_loop, daemon=True).start()
+
+    def recent(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """The latest kept traces, newest first."""
+        return list(self.buffer)[::-1][:limit]
+
+    def _expire(self) -> None:
+        """Forget the spans that have been open for longer than `span_ttl`."""
+        cutoff = time.time() - self.span_ttl
+        expired = [
+            run_id
+            for run_id, span in list(self._spans.items())
+            if span["start"] < cutoff
+        ]
+        for run_id in expired:
+            self._spans.pop(run_id, None)
+            self._traces.pop(run_id, None)
+        if expired:
+            logger.warning(f"Dropped {len(expired)} spans that never ended")
+
+    def _start(
+        self,
+        run_type: str,
+        serialized: Optional[Dict[str, Any]],
+        run_id: UUID,
+        parent_run_id: Optional[UUID],
+        kwargs: Dict[str, Any],
+    ) -> None:
+        if is_replayed(kwargs):
+            # The spans were recorded in real time on the first request.
+            return
+        if parent_run_id is None:
+            now = time.monotonic()
+            if now - self._last_expiry > min(self.span_ttl, 60.0):
+                self._last_expiry = now
+                self._expire()
+            trace = _Trace(str(run_id), random.random() < self.sample_rate)
+        else:
+            trace = self._traces.get(parent_run_id)
+            if trace is None:
+                return
+        if not trace.sampled and self.slow_threshold is None:
+            # Neither sampled nor eligible for tail retention.
+            return
+        self._traces[run_id] = trace
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        if name is None:
+            name = ((serialized or {}).get("id") or [run_type])[-1]
+        self._spans[run_id] = {
+            "run_id": str(run_id),
+            "parent_run_id": str(parent_run_id) if parent_run_id else None,
+            "name": name,
+            "run_type": run_type,
+            "start": time.time(),
+            "duration": None,
+            "status": "running",
+            "error": None,
+            "tags": kwargs.get("tags") or [],
+        }
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None) -> None:
+        trace = self._traces.pop(run_id, None)
+        span = self._spans.pop(run_id, None)
+        if trace is None or span is None:
+            return
+        span["duration"] = time.time() - span["start"]
+        span["status"] = "ok" if error is None else "error"
+        if error is not None:
+            span["error"] = f"{type(error).__name__}: {error}"
+        trace.spans.append(span)
+        if span["run_id"] == trace.trace_id:
+            self._finish(trace, span)
+
+    def _finish(self, trace: _Trace, root: Dict[str, Any]) -> None:
+        if trace.sampled:
+            retained = "sampled"
+        elif root["status"] == "error":
+            retained = "error"
+        elif (
+            self.slow_threshold is not None and root["duration"] >= self.slow_threshold
+        ):
+            retained = "slow"
+        else:
+            return
+        record = {
+            "trace_id": trace.trace_id,
+            "name": root["name"],
+            "start": root["start"],
+            "duration": root["duration"],
+            "status": root["status"],
+            "retained": retained,
+            # Parents end after their children, so put them back in start order.
+            "spans": sorted(trace.spans, key=lambda span: span["start"]),
+        }
+        self.buffer.append(record)
+        if self.sink is not None:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                logger.warning("Trace writer is behind, dropping a trace")
+
+    def _write_loop(self) -> None:
+        while True:
+            traces = [self._queue.get()]
+            while len(traces) < 100:
+                try:
+                    traces.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.sink.write(traces)
+            except Exception:
+                logger.exception("Failed to write traces")
+
+    def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Any,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start("chain", serialized, run_id, parent_run_id, kwargs)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id, error)
+
+    def on_retriever_start(
+        self,
+        serialized: Dict[str, Any],
+        query: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start("retriever", serialized, run_id, parent_run_id, kwargs)
+
+    def on_retriever_end(self, documents: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_retriever_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id, error)
+
+    def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: List[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start("llm", serialized, run_id, parent_run_id, kwargs)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id, error)
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict[str, Any],
+        messages: List[List[Any]],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start("llm", serialized, run_id, parent_run_id, kwargs)
+
+    def on_tool_start(
+        self,
+        serialized: Dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        self._start("tool", serialized, run_id, parent_run_id, kwargs)
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._end(run_id, error)
+
+
+_tracer: Optional[LocalTracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> LocalTracer:
+    """Process-wide tracer configured from the environment.
+
+    TRACE_SAMPLE_RATE (default 0.01) is the head sampling rate,
+    TRACE_SLOW_THRESHOLD (seconds, default 10, empty to disable) keeps slow
+    traces, and TRACE_SINK picks `jsonl` (default), `sqlite` or `none`.
+    TRACE_SPAN_TTL (seconds, default 3600) bounds how long an unfinished
+    run is kept. LangSmith tracing is turned off, so runs do not leave the
+    machine, unless TRACE_LANGSMITH is true.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            if (os.environ.get("TRACE_LANGSMITH") or "false").lower() != "true":
+                disable_langsmith_tracing()
+            sink_name = (os.environ.get("TRACE_SINK") or "jsonl").lower()
+            sink = {"jsonl": JsonlSink, "sqlite": SqliteSink}.get(sink_name)
+            slow_threshold = os.environ.get("TRACE_SLOW_THRESHOLD", "10")
+            _tracer = LocalTracer(
+                sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE") or 0.01),
+                slow_threshold=float(slow_threshold) if slow_threshold else None,
+                sink=sink() if sink is not None else None,
+                span_ttl=float(os.environ.get("TRACE_SPAN_TTL") or 3600),
+            )
+        return _tracer
@@ -0,0 +1,204 @@
+"""Versioned on-disk store of LangChain Hub prompts.
+
+Every prompt version is kept as `<owner>/<repo>/<commit>.json` under
+PROMPT_CACHE_DIR, and `pins.json` maps each prompt name to the commit hash
+that was served the last time. Prompts are read from disk, so neither cold
+start nor a request waits for the hub once a prompt has been fetched.
+
+A name with a commit, `owner/repo:commit`, is fixed. A name without one
+follows the hub: a background thread pulls it every
+PROMPT_REFRESH_INTERVAL seconds and moves the pin when the hub has a new
+commit. Chains already built keep the version they were built with, the
+new one is served to later lookups and from the next start. Set
+PROMPT_REFRESH to false to never contact the hub after the first fetch.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from langchain import hub
+from langchain_core.load.dump import dumps
+from langchain_core.load.load import loads
+from langchain_core.prompts import BasePromptTemplate
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_DIR = os.environ.get(
+    "PROMPT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "nexx", "prompts"),
+)
+
+
+def _split(name: str) -> Tuple[str, Optional[str]]:
+    repo, _, commit = name.partition(":")
+    return repo, commit or None
+
+
+class HubPromptCache:
+    """Hub prompts served from memory, backed by the versions on disk."""
+
+    def __init__(
+        self,
+        path: str = PROMPT_CACHE_DIR,
+        refresh: bool = True,
+        refresh_interval: float = 24 * 3600,
+    ):
+        self.path = path
+        self.refresh_enabled = refresh
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._prompts: Dict[str, BasePromptTemplate] = {}
+        self._pins: Dict[str, str] = self._read_pins()
+        self._fetched_at: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _pins_path(self) -> str:
+        return os.path.join(self.path, "pins.json")
+
+    def _version_path(self, repo: str, commit: str) -> str:
+        return os.path.join(self.path, repo, f"{commit}.json")
+
+    def _read_pins(self) -> Dict[str, str]:
+        try:
+            with open(self._pins_path(), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable prompt pins: {e}")
+            return {}
+
+    def _write(self, path: str, text: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    def _load(self, repo: str, commit: str) -> Optional[BasePromptTemplate]:
+        try:
+            with open(self._version_path(repo, commit), encoding="utf-8") as f:
+                return loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _fetch(self, name: str) -> Tuple[BasePromptTemplate, Optional[str]]:
+        """Pull from the hub and store the version under its commit hash."""
+        repo, commit = _split(name)
+        prompt = hub.pull(name)
+        self._fetched_at[name] = time.monotonic()
+        commit = commit or (prompt.metadata or {}).get("lc_hub_commit_hash")
+        if commit:
+            self._write(self._version_path(repo, commit), dumps(prompt))
+        else:
+            # Older hub clients do not report the commit; nothing to pin.
+            logger.warning(f"Hub did not report a commit for {name}, not caching")
+        return prompt, commit
+
+    def _pin(self, repo: str, commit: str) -> None:
+        self._pins[repo] = commit
+        self._write(self._pins_path(), json.dumps(self._pins, indent=2))
+
+    def get(self, name: str) -> BasePromptTemplate:
+        """The prompt `owner/repo` or `owner/repo:commit`.
+
+        Only a prompt that has never been fetched is pulled from the hub.
+        """
+        prompt = self._prompts.get(name)
+        if prompt is not None:
+            return prompt
+        with self._lock:
+            prompt = self._prompts.get(name)
+            if prompt is not None:
+                return prompt
+            repo, commit = _split(name)
+            commit = commit or self._pins.get(repo)
+            if commit:
+                prompt = self._load(repo, commit)
+            if prompt is None:
+                logger.info(f"Prompt {name} is not cached, pulling it from the hub")
+                prompt, commit = self._fetch(name)
+                if commit and _split(name)[1] is None:
+                    self._pin(repo, commit)
+            self._prompts[name] = prompt
+        self._start_refresh()
+        return prompt
+
+    def refresh(self) -> None:
+        """Pull followed prompts and move their pins to the hub's latest commit.
+
+        Prompts pulled less than `refresh_interval` seconds ago are skipped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            names = [
+                name
+                for name in self._prompts
+                if _split(name)[1] is None
+                and now - self._fetched_at.get(name, -self.refresh_interval)
+                >= self.refresh_interval
+            ]
+        for name in names:
+            try:
+                prompt, commit = self._fetch(name)
+            except Exception as e:
+                logger.warning(f"Refreshing prompt {name} failed: {e}")
+                continue
+            with self._lock:
+                if commit and commit != self._pins.get(name):
+                    logger.info(f"Prompt {name} updated to {commit}")
+                    self._pin(name, commit)
+                    self._prompts[name] = prompt
+
+    def _start_refresh(self) -> None:
+        if not self.refresh_enabled or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._refresh_loop, name="prompt-refresh", daemon=True
+                )
+                self._thread.start()
+
+    def _refresh_loop(self) -> None:
+        # The first round checks the versions loaded from disk at startup.
+        while True:
+            self.refresh()
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+_cache: Optional[HubPromptCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_prompt_cache() -> HubPromptCache:
+    """Process-wide prompt store configured from the environment.
+
+    PROMPT_CACHE_DIR (default ~/.cache/nexx/prompts) is where versions are
+    kept, PROMPT_REFRESH (default true) enables the background refresh and
+    PROMPT_REFRESH_INTERVAL (default 86400) is its period in seconds.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HubPromptCache(
+                refresh=(os.environ.get("PROMPT_REFRESH") or "true").lower() == "true",
+                refresh_interval=float(
+                    os.environ.get("PROMPT_REFRESH_INTERVAL") or 24 * 3600
+                ),
+            )
+        return _cache
+
+
+def pull(name: str) -> BasePromptTemplate:
+    """Drop-in replacement for `hub.pull` that serves prompts from disk."""
+    return get_prompt_cache().get(name)
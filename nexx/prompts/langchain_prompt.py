@@ -28,3 +28,31 @@ REPHRASE_TEMPLATE = """\
 {chat_history}
 后续输入：{question}
 独立问题："""
+
+
+SUMMARIZE_HISTORY_TEMPLATE = """\
+逐步总结对话内容：在当前摘要的基础上补充新的对话，返回一个新的简洁摘要。保留对后续问题有用的名称、事实和结论。
+
+当前摘要：
+{summary}
+
+新的对话：
+{new_lines}
+
+新的摘要："""
+
+
+HISTORY_SUMMARY_TEMPLATE = """\
+以下是之前对话的摘要：
+{summary}"""
+
+
+HISTORY_SUMMARY_ACK = "好的，我会结合这段摘要继续对话。"
+
+
+MULTI_QUERY_TEMPLATE = """\
+您是一名AI语言模型助手。请针对下面的问题生成 {num_queries} 个不同表述的搜索查询，\
+用于从向量数据库中检索相关文档。从不同角度改写问题，帮助克服基于距离的相似度搜索的局限。\
+每行输出一个查询，不要编号，也不要输出其他内容。
+
+原始问题：{question}"""
@@ -0,0 +1,105 @@
+import logging
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from nexx.observability.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+ADAPTIVE_K_DOCUMENTS = Counter(
+    "retriever_adaptive_k_documents_total",
+    "Documents fetched by the adaptive-k retriever, by whether they were kept.",
+    ["result"],
+)
+
+
+class AdaptiveKRetriever(BaseRetriever):
+    """Choose k per query from the relevance score distribution.
+
+    Up to `max_k` documents are fetched with their relevance scores (0 to 1,
+    higher is better). The first `min_k` are always kept. After that the list
+    is cut at the first document that scores below `score_threshold`, or that
+    is more than `max_gap` below the previous one, since a sharp drop usually
+    separates the relevant documents from the rest.
+
+    Kept documents are copies that carry their `relevance_score` and the
+    number of dropped documents as `dropped_count` in their metadata, so
+    documents a vector store or cache hands out are never changed. Like
+    `FilteredVectorStoreRetriever`, it takes a per-request `filter`.
+    """
+
+    vectorstore: VectorStore
+    min_k: int = 1
+    max_k: int = 10
+    score_threshold: float = 0.3
+    max_gap: float = 0.15
+
+    def _cut(self, docs_and_scores: List[Tuple[Document, float]]) -> List[Document]:
+        kept = 0
+        previous: Optional[float] = None
+        for _, score in docs_and_scores:
+            if kept >= self.min_k and (
+                score < self.score_threshold
+                or (previous is not None and previous - score > self.max_gap)
+            ):
+                break
+            kept += 1
+            previous = score
+
+        dropped = len(docs_and_scores) - kept
+        ADAPTIVE_K_DOCUMENTS.inc(kept, result="kept")
+        ADAPTIVE_K_DOCUMENTS.inc(dropped, result="dropped")
+        logger.debug(f"Adaptive k kept {kept} and dropped {dropped} documents")
+
+        return [
+            Document(
+                page_content=doc.page_content,
+                metadata={
+                    **doc.metadata,
+                    "relevance_score": score,
+                    "dropped_count": dropped,
+                },
+            )
+            for doc, score in docs_and_scores[:kept]
+        ]
+
+    def _search_kwargs(self, filter: Optional[dict]) -> dict:
+        search_kwargs: dict = {"k": self.max_k}
+        if filter:
+            search_kwargs["filter"] = filter
+        return search_kwargs
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        docs_and_scores = self.vectorstore.similarity_search_with_relevance_scores(
+            query, **self._search_kwargs(filter)
+        )
+        return self._cut(docs_and_scores)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        docs_and_scores = (
+            await self.vectorstore.asimilarity_search_with_relevance_scores(
+                query, **self._search_kwargs(filter)
+            )
+        )
+        return self._cut(docs_and_scores)
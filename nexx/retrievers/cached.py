@@ -0,0 +1,157 @@
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import Field
+from langchain_core.retrievers import BaseRetriever
+
+from nexx.ingests.index_version import get_index_version
+from nexx.observability.metrics import Counter, Gauge
+
+RETRIEVAL_CACHE_REQUESTS = Counter(
+    "retrieval_cache_requests_total",
+    "Retrieval cache lookups by result.",
+    ["collection", "result"],
+)
+RETRIEVAL_CACHE_HIT_RATIO = Gauge(
+    "retrieval_cache_hit_ratio",
+    "Share of retrieval cache lookups served from the cache.",
+    ["collection"],
+)
+
+_TRAILING_PUNCTUATION = "?？。.!！"
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivially different spellings share a key."""
+    question = unicodedata.normalize("NFKC", question).casefold()
+    question = re.sub(r"\s+", " ", question).strip()
+    return question.rstrip(_TRAILING_PUNCTUATION).strip()
+
+
+class RetrievalCache:
+    """LRU cache of retrieval results with a TTL and an index version.
+
+    Entries are dropped when they are older than `ttl` seconds or were stored
+    under an older index version than the one they are looked up with.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Tuple, Tuple[float, int, List[Document]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Tuple, version: int) -> Optional[List[Document]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, stored_version, docs = entry
+            if stored_version != version or time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(docs)
+
+    def put(self, key: Tuple, version: int, docs: List[Document]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), version, list(docs))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedRetriever(BaseRetriever):
+    """Serve repeated questions from a `RetrievalCache`.
+
+    The cache key is the normalized question together with `k` and any
+    metadata filter. Bumping the collection's index version (done by
+    `ingest_docs`) invalidates all cached results.
+    """
+
+    retriever: BaseRetriever
+    collection_name: str
+    cache: RetrievalCache = Field(default_factory=RetrievalCache)
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        collection = self.collection_name
+        RETRIEVAL_CACHE_HIT_RATIO.set_function(
+            lambda: _hit_ratio(collection), collection=collection
+        )
+
+    def _key(self, query: str, kwargs: Dict[str, Any]) -> Tuple:
+        search_kwargs = getattr(self.retriever, "search_kwargs", None) or {}
+        k = kwargs.get("k", search_kwargs.get("k", getattr(self.retriever, "k", None)))
+        filter = kwargs.get("filter", search_kwargs.get("filter"))
+        return (
+            normalize_question(query),
+            k,
+            json.dumps(filter, sort_keys=True, ensure_ascii=False, default=str),
+        )
+
+    def _lookup(self, query: str, kwargs: Dict[str, Any]):
+        key = self._key(query, kwargs)
+        version = get_index_version(self.collection_name)
+        docs = self.cache.get(key, version)
+        RETRIEVAL_CACHE_REQUESTS.inc(
+            collection=self.collection_name,
+            result="miss" if docs is None else "hit",
+        )
+        return key, version, docs
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        **kwargs: Any,
+    ) -> List[Document]:
+        key, version, docs = self._lookup(query, kwargs)
+        if docs is None:
+            docs = self.retriever.invoke(
+                query, {"callbacks": run_manager.get_child()}, **kwargs
+            )
+            self.cache.put(key, version, docs)
+        return docs
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        **kwargs: Any,
+    ) -> List[Document]:
+        key, version, docs = self._lookup(query, kwargs)
+        if docs is None:
+            docs = await self.retriever.ainvoke(
+                query, {"callbacks": run_manager.get_child()}, **kwargs
+            )
+            self.cache.put(key, version, docs)
+        return docs
+
+
+def _hit_ratio(collection: str) -> float:
+    hits = RETRIEVAL_CACHE_REQUESTS.value(collection=collection, result="hit")
+    misses = RETRIEVAL_CACHE_REQUESTS.value(collection=collection, result="miss")
+    total = hits + misses
+    return hits / total if total else 0.0
@@ -0,0 +1,232 @@
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+FILTERABLE_FIELDS = ("doc_set", "source", "title", "language")
+METADATA_INDEX_DIR = os.environ.get(
+    "METADATA_INDEX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "nexx", "metadata_index"),
+)
+
+Filters = Dict[str, Union[str, List[str]]]
+
+
+class UnknownFilterFieldError(ValueError):
+    """A filter names a metadata field that was not indexed."""
+
+
+def normalize_metadata_value(field: str, value: Any) -> str:
+    value = str(value or "").strip()
+    if field == "language":
+        # "en-US" and "en_us" both become "en".
+        return value.replace("_", "-").split("-")[0].lower()
+    if field == "doc_set":
+        return value.lower()
+    return value
+
+
+def normalize_metadata(doc: Document) -> Document:
+    """Give every filterable field a normalized, non-null value."""
+    for field in FILTERABLE_FIELDS:
+        doc.metadata[field] = normalize_metadata_value(field, doc.metadata.get(field))
+    return doc
+
+
+def to_where(filters: Optional[Filters]) -> Optional[dict]:
+    """Translate `{"field": value or [values]}` into a Chroma `where` clause."""
+    clauses = []
+    for field, value in (filters or {}).items():
+        values = [value] if isinstance(value, str) else list(value)
+        values = [normalize_metadata_value(field, value) for value in values]
+        if len(values) == 1:
+            clauses.append({field: {"$eq": values[0]}})
+        else:
+            clauses.append({field: {"$in": values}})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class MetadataIndex:
+    """Value counts of the filterable metadata fields of a collection.
+
+    Built at ingest time, it lets the server reject filters on unknown fields
+    and answer filters that cannot match anything without touching the
+    vector store at all.
+    """
+
+    def __init__(self, values: Dict[str, Dict[str, int]]):
+        self.values = values
+
+    @classmethod
+    def from_documents(
+        cls, docs: Iterable[Document], fields: Sequence[str] = FILTERABLE_FIELDS
+    ) -> "MetadataIndex":
+        values: Dict[str, Dict[str, int]] = {field: {} for field in fields}
+        for doc in docs:
+            for field in fields:
+                value = doc.metadata.get(field, "")
+                values[field][value] = values[field].get(value, 0) + 1
+        return cls(values)
+
+    def validate(self, filters: Optional[Filters]) -> None:
+        """Raise `UnknownFilterFieldError` for fields that were not indexed."""
+        unknown = set(filters or {}) - set(self.values)
+        if unknown:
+            raise UnknownFilterFieldError(
+                f"Cannot filter on {sorted(unknown)}, "
+                f"indexed fields are {sorted(self.values)}"
+            )
+
+    def count(self, filters: Optional[Filters]) -> Optional[int]:
+        """Upper bound of matching documents, None when nothing is filtered."""
+        self.validate(filters)
+        bound = None
+        for field, value in (filters or {}).items():
+            values = [value] if isinstance(value, str) else list(value)
+            matches = sum(
+                self.values[field].get(normalize_metadata_value(field, value), 0)
+                for value in values
+            )
+            bound = matches if bound is None else min(bound, matches)
+        return bound
+
+    def save(self, collection_name: str, dir: str = METADATA_INDEX_DIR) -> None:
+        os.makedirs(dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.values, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(dir, f"{collection_name}.json"))
+
+
+_lock = threading.Lock()
+_loaded: Dict[str, Tuple[Tuple[int, int], MetadataIndex]] = {}
+
+
+def get_metadata_index(
+    collection_name: str, dir: str = METADATA_INDEX_DIR
+) -> Optional[MetadataIndex]:
+    """Load a collection's index, re-reading it only after ingest rewrote it."""
+    path = os.path.join(dir, f"{collection_name}.json")
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_ino)
+    with _lock:
+        loaded = _loaded.get(path)
+        if loaded is not None and loaded[0] == stamp:
+            return loaded[1]
+    with open(path, "r", encoding="utf-8") as f:
+        index = MetadataIndex(json.load(f))
+    with _lock:
+        _loaded[path] = (stamp, index)
+    return index
+
+
+class FilteredVectorStoreRetriever(BaseRetriever):
+    """Vector store retriever that takes a per-request `filter` argument.
+
+    `filter` is a Chroma `where` clause, see `to_where`.
+    """
+
+    vectorstore: VectorStore
+    k: int = 6
+
+    def _search_kwargs(self, filter: Optional[dict]) -> dict:
+        search_kwargs: dict = {"k": self.k}
+        if filter:
+            search_kwargs["filter"] = filter
+        return search_kwargs
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return self.vectorstore.similarity_search(query, **self._search_kwargs(filter))
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return await self.vectorstore.asimilarity_search(
+            query, **self._search_kwargs(filter)
+        )
+
+
+class MetadataFilterRetriever(BaseRetriever):
+    """Apply the `filters` of a request to another retriever.
+
+    Filters are checked against the collection's `MetadataIndex`: filters on
+    fields that were not indexed raise an `UnknownFilterFieldError`, and
+    filters that cannot match any document return nothing without a
+    vector search. The rest are passed on as a Chroma `where` clause in the
+    `filter` argument.
+    """
+
+    retriever: BaseRetriever
+    collection_name: str
+
+    def validate_filters(self, filters: Optional[Filters]) -> None:
+        """Check `filters` up front, before a response has started."""
+        index = get_metadata_index(self.collection_name)
+        if filters and index is not None:
+            index.validate(filters)
+
+    def _where(self, filters: Optional[Filters]) -> Tuple[bool, Optional[dict]]:
+        index = get_metadata_index(self.collection_name)
+        if filters and index is not None and index.count(filters) == 0:
+            return False, None
+        return True, to_where(filters)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filters: Optional[Filters] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        can_match, where = self._where(filters)
+        if not can_match:
+            return []
+        if where is not None:
+            kwargs["filter"] = where
+        return self.retriever.invoke(
+            query, {"callbacks": run_manager.get_child()}, **kwargs
+        )
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filters: Optional[Filters] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        can_match, where = self._where(filters)
+        if not can_match:
+            return []
+        if where is not None:
+            kwargs["filter"] = where
+        return await self.retriever.ainvoke(
+            query, {"callbacks": run_manager.get_child()}, **kwargs
+        )
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import zlib
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from langchain.storage import LocalFileStore, create_kv_docstore
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.stores import BaseStore, ByteStore
+from langchain_core.vectorstores import VectorStore
+
+PARENT_ID_KEY = "parent_id"
+PARENT_DOCSTORE_PATH = os.environ.get(
+    "PARENT_DOCSTORE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "nexx", "parent_docstore"),
+)
+
+
+class ZlibByteStore(ByteStore):
+    """Compress the values of another byte store with zlib."""
+
+    def __init__(self, store: ByteStore, level: int = 6):
+        self.store = store
+        self.level = level
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        return [
+            zlib.decompress(value) if value is not None else None
+            for value in self.store.mget(keys)
+        ]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, bytes]]) -> None:
+        self.store.mset(
+            [(key, zlib.compress(value, self.level)) for key, value in key_value_pairs]
+        )
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        self.store.mdelete(keys)
+
+    def yield_keys(self, *, prefix: Optional[str] = None) -> Iterator[str]:
+        yield from self.store.yield_keys(prefix=prefix)
+
+
+def get_parent_docstore(path: str = PARENT_DOCSTORE_PATH) -> BaseStore[str, Document]:
+    """Docstore holding the parent sections of small-to-big retrieval."""
+    return create_kv_docstore(ZlibByteStore(LocalFileStore(path)))
+
+
+def parent_id(doc: Document) -> str:
+    """Stable id of a parent section, so re-ingesting it keeps its key."""
+    payload = f"{doc.metadata.get('source', '')}\n{doc.page_content}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def approximate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+class SmallToBigRetriever(BaseRetriever):
+    """Match on small child chunks, return their parent sections.
+
+    Up to `child_k` children are retrieved from the vector store. Their parents
+    are looked up in the docstore in rank order, deduplicated, and returned
+    until either `k` parents or `token_budget` tokens are reached. The best
+    ranked parent is always returned.
+    """
+
+    vectorstore: VectorStore
+    docstore: BaseStore[str, Document]
+    k: int = 6
+    child_k: int = 30
+    token_budget: int = 3000
+    length_function: Callable[[str], int] = approximate_tokens
+
+    def _parent_ids(self, children: List[Document]) -> List[str]:
+        ids: List[str] = []
+        for child in children:
+            id = child.metadata.get(PARENT_ID_KEY)
+            if id is not None and id not in ids:
+                ids.append(id)
+        return ids
+
+    def _within_budget(self, parents: List[Optional[Document]]) -> List[Document]:
+        selected: List[Document] = []
+        used = 0
+        for parent in parents:
+            if parent is None:
+                continue
+            tokens = self.length_function(parent.page_content)
+            if selected and used + tokens > self.token_budget:
+                continue
+            selected.append(parent)
+            used += tokens
+            if len(selected) >= self.k:
+                break
+        return selected
+
+    def _search_kwargs(self, filter: Optional[dict]) -> dict:
+        search_kwargs: dict = {"k": self.child_k}
+        if filter:
+            search_kwargs["filter"] = filter
+        return search_kwargs
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        children = self.vectorstore.similarity_search(
+            query, **self._search_kwargs(filter)
+        )
+        parents = self.docstore.mget(self._parent_ids(children))
+        return self._within_budget(parents)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> List[Document]:
+        children = await self.vectorstore.asimilarity_search(
+            query, **self._search_kwargs(filter)
+        )
+        parents = await self.docstore.amget(self._parent_ids(children))
+        return self._within_budget(parents)
@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from nexx.observability.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_REQUESTS = Counter(
+    "admission_requests_total",
+    "Requests by route, priority and admission result.",
+    ["route", "priority", "result"],
+)
+ADMISSION_QUEUE_SECONDS = Counter(
+    "admission_queue_seconds_total",
+    "Time admitted requests spent waiting in the queue.",
+    ["route", "priority"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth",
+    "Requests waiting for a slot.",
+    ["route", "priority"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Requests holding a slot.",
+    ["route"],
+)
+
+# Lower value is served first.
+PRIORITIES = {"interactive": 0, "batch": 1}
+PRIORITY_HEADER = b"x-priority"
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionQueue:
+    """Bounded concurrency with a priority queue and a queue-time SLO.
+
+    At most `max_concurrency` requests hold a slot at once. The others wait
+    in a queue of at most `max_queue` requests, served by priority and then
+    in arrival order. A request is rejected right away with 429 when the
+    queue is full, and with 503 when its expected wait, estimated from the
+    queue ahead of it and the recent service time, already exceeds
+    `max_queue_time`. Requests that do wait longer than that are rejected
+    with 503 as well.
+    """
+
+    def __init__(
+        self,
+        route: str,
+        max_concurrency: int,
+        max_queue: int = 64,
+        max_queue_time: float = 10.0,
+        alpha: float = 0.2,
+    ):
+        self.route = route
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.alpha = alpha
+        self.in_flight = 0
+        self.service_time: Optional[float] = None
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        ADMISSION_IN_FLIGHT.set_function(lambda: self.in_flight, route=route)
+        for priority, rank in PRIORITIES.items():
+            ADMISSION_QUEUE_DEPTH.set_function(
+                lambda rank=rank: self._depth(rank), route=route, priority=priority
+            )
+
+    def _depth(self, rank: Optional[int] = None) -> int:
+        return sum(
+            1
+            for waiter_rank, _, future in self._waiters
+            if not future.done() and (rank is None or waiter_rank == rank)
+        )
+
+    def expected_wait(self, rank: int) -> float:
+        """Rough wait of a new request with priority `rank`, in seconds."""
+        if self.in_flight < self.max_concurrency or self.service_time is None:
+            return 0.0
+        ahead = sum(
+            1
+            for waiter_rank, _, future in self._waiters
+            if not future.done() and waiter_rank <= rank
+        )
+        return (ahead + 1) * self.service_time / self.max_concurrency
+
+    async def acquire(self, priority: str) -> None:
+        rank = PRIORITIES[priority]
+        if self.in_flight < self.max_concurrency and not self._depth():
+            self.in_flight += 1
+            ADMISSION_REQUESTS.inc(
+                route=self.route, priority=priority, result="admitted"
+            )
+            return
+        if self._depth() >= self.max_queue:
+            ADMISSION_REQUESTS.inc(
+                route=self.route, priority=priority, result="rejected_queue_full"
+            )
+            raise Rejected(429, "Too many queued requests", self.max_queue_time)
+        expected = self.expected_wait(rank)
+        if expected > self.max_queue_time:
+            ADMISSION_REQUESTS.inc(
+                route=self.route, priority=priority, result="rejected_slo"
+            )
+            raise Rejected(503, "Expected queue time exceeds the SLO", expected)
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._counter), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_queue_time)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                ADMISSION_REQUESTS.inc(
+                    route=self.route, priority=priority, result="timed_out"
+                )
+                raise Rejected(503, "Queue time exceeded the SLO", self.max_queue_time)
+        except BaseException:
+            # The client went away while waiting, hand a granted slot on.
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                future.cancel()
+            raise
+        ADMISSION_QUEUE_SECONDS.inc(
+            time.monotonic() - start, route=self.route, priority=priority
+        )
+        ADMISSION_REQUESTS.inc(route=self.route, priority=priority, result="admitted")
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        if service_time is not None:
+            self.service_time = (
+                service_time
+                if self.service_time is None
+                else self.alpha * service_time + (1 - self.alpha) * self.service_time
+            )
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # The slot passes straight to the next waiter.
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware applying an `AdmissionQueue` per route prefix.
+
+    Only POST requests, the ones that run a chain, are queued. The priority
+    comes from the `X-Priority` header, `interactive` (the default) or
+    `batch`. Rejected requests get a JSON error and a `Retry-After` header.
+    """
+
+    def __init__(self, app, queues: Dict[str, AdmissionQueue]):
+        self.app = app
+        # Longest prefix first, so nested routes get their own queue.
+        self.queues = sorted(queues.items(), key=lambda item: -len(item[0]))
+
+    def _queue(self, scope) -> Optional[AdmissionQueue]:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return None
+        for prefix, queue in self.queues:
+            if scope["path"].startswith(prefix):
+                return queue
+        return None
+
+    async def __call__(self, scope, receive, send):
+        queue = self._queue(scope)
+        if queue is None:
+            await self.app(scope, receive, send)
+            return
+
+        priority = "interactive"
+        for name, value in scope.get("headers", []):
+            if name == PRIORITY_HEADER:
+                priority = value.decode("latin-1").strip().lower()
+        if priority not in PRIORITIES:
+            priority = "interactive"
+
+        try:
+            await queue.acquire(priority)
+        except Rejected as e:
+            logger.warning(f"Rejected {scope['path']} ({priority}): {e.reason}")
+            await _send_rejection(send, e)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            queue.release(time.monotonic() - start)
+
+
+async def _send_rejection(send, rejected: Rejected) -> None:
+    body = json.dumps({"detail": rejected.reason}).encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": rejected.status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(max(1, round(rejected.retry_after))).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Type
+
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import patch_config, run_in_executor
+from langchain_core.runnables.utils import ConfigurableFieldSpec, Input, Output
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE_PATH = os.environ.get(
+    "SESSION_STORE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "nexx", "sessions.sqlite3"),
+)
+SESSION_TTL = float(os.environ.get("SESSION_TTL") or 24 * 3600)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    turn TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+"""
+
+
+class SessionStore:
+    """Conversation turns per session id, in a local SQLite database.
+
+    Turns are stored as `{"human": ..., "ai": ...}` dicts, the format of
+    `ChatInput.chat_history`, and `get` adds the `seq` of each turn, its
+    position in the whole conversation, which stays the same when older
+    turns are dropped. Sessions that were not used for `ttl` seconds
+    are treated as gone and deleted by `evict_expired`, which `append` runs
+    every `evict_interval` seconds. Only the last `max_turns` turns of a
+    session are kept.
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_STORE_PATH,
+        ttl: float = SESSION_TTL,
+        max_turns: int = 200,
+        evict_interval: float = 60.0,
+    ):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.evict_interval = evict_interval
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        """Turns of a session, oldest first, empty if it is unknown or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None or time.time() - row[0] > self.ttl:
+                return []
+            rows = self._conn.execute(
+                "SELECT seq, turn FROM turns WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        return [{**json.loads(turn), "seq": seq} for seq, turn in rows]
+
+    def append(self, session_id: str, human: str, ai: str) -> None:
+        now = time.time()
+        turn = json.dumps({"human": human, "ai": ai}, ensure_ascii=False)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT updated_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is not None and now - row[0] > self.ttl:
+                self._delete(session_id)
+            (last,) = self._conn.execute(
+                "SELECT MAX(seq) FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            seq = 0 if last is None else last + 1
+            self._conn.execute(
+                "INSERT INTO turns (session_id, seq, turn) VALUES (?, ?, ?)",
+                (session_id, seq, turn),
+            )
+            self._conn.execute(
+                "DELETE FROM turns WHERE session_id = ? AND seq <= ?",
+                (session_id, seq - self.max_turns),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, updated_at) VALUES (?, ?)",
+                (session_id, now),
+            )
+        if now - self._last_eviction > self.evict_interval:
+            self.evict_expired()
+
+    def delete(self, session_id: str) -> None:
+        with self._lock, self._conn:
+            self._delete(session_id)
+
+    def _delete(self, session_id: str) -> None:
+        self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+        self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def evict_expired(self) -> int:
+        """Delete the sessions that expired, return how many there were."""
+        cutoff = time.time() - self.ttl
+        with self._lock, self._conn:
+            self._last_eviction = time.time()
+            self._conn.execute(
+                "DELETE FROM turns WHERE session_id IN "
+                "(SELECT session_id FROM sessions WHERE updated_at < ?)",
+                (cutoff,),
+            )
+            evicted = self._conn.execute(
+                "DELETE FROM sessions WHERE updated_at < ?", (cutoff,)
+            ).rowcount
+        if evicted:
+            logger.info(f"Evicted {evicted} expired sessions")
+        return evicted
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()
+        return count
+
+
+class SessionHistoryRunnable(Runnable[Dict, str]):
+    """Keep the chat history of a chat chain on the server.
+
+    Requests that carry a `session_id` but no `chat_history` get the stored
+    history of that session filled in, and the question and the answer are
+    appended to it once the answer is complete. Requests that send their own
+    `chat_history` are passed through unchanged and not stored, so older
+    clients keep working.
+    """
+
+    def __init__(self, chain: Runnable[Dict, str], store: SessionStore):
+        self.chain = chain
+        self.store = store
+
+    @property
+    def InputType(self) -> Type[Input]:
+        return self.chain.InputType
+
+    @property
+    def OutputType(self) -> Type[Output]:
+        return self.chain.OutputType
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return self.chain.config_specs
+
+    def _session_id(self, input: Dict) -> Optional[str]:
+        if input.get("chat_history") is not None:
+            return None
+        return input.get("session_id")
+
+    def invoke(
+        self, input: Dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> str:
+        return "".join(self.stream(input, config, **kwargs))
+
+    async def ainvoke(
+        self, input: Dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> str:
+        return "".join([chunk async for chunk in self.astream(input, config, **kwargs)])
+
+    def stream(
+        self, input: Dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[str]:
+        yield from self._transform_stream_with_config(
+            iter([input]), self._transform, config, **kwargs
+        )
+
+    async def astream(
+        self, input: Dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        async def input_aiter() -> AsyncIterator[Dict]:
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(
+            input_aiter(), self._atransform, config, **kwargs
+        ):
+            yield chunk
+
+    def _transform(
+        self, input: Iterator[Dict], run_manager, config, **kwargs: Any
+    ) -> Iterator[str]:
+        child_config = patch_config(config, callbacks=run_manager.get_child())
+        for final in input:
+            session_id = self._session_id(final)
+            if session_id is not None:
+                final = {**final, "chat_history": self.store.get(session_id)}
+            answer = []
+            for chunk in self.chain.stream(final, child_config, **kwargs):
+                answer.append(chunk)
+                yield chunk
+            if session_id is not None:
+                self.store.append(session_id, final["question"], "".join(answer))
+
+    async def _atransform(
+        self, input: AsyncIterator[Dict], run_manager, config, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        child_config = patch_config(config, callbacks=run_manager.get_child())
+        async for final in input:
+            session_id = self._session_id(final)
+            if session_id is not None:
+                history = await run_in_executor(
+                    child_config, self.store.get, session_id
+                )
+                final = {**final, "chat_history": history}
+            answer = []
+            async for chunk in self.chain.astream(final, child_config, **kwargs):
+                answer.append(chunk)
+                yield chunk
+            if session_id is not None:
+                await run_in_executor(
+                    child_config,
+                    self.store.append,
+                    session_id,
+                    final["question"],
+                    "".join(answer),
+                )
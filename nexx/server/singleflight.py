@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import AsyncCallbackManager, ahandle_event
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import var_child_runnable_config
+from langchain_core.runnables.utils import ConfigurableFieldSpec, Input, Output
+
+from nexx.llms.utils import aggregate_chunks
+from nexx.observability.callbacks import REPLAYED
+from nexx.observability.metrics import Counter, Gauge
+from nexx.retrievers.cached import normalize_question
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_REQUESTS = Counter(
+    "singleflight_requests_total",
+    "Requests that started a chain execution (leader) or joined one (follower).",
+    ["name", "role"],
+)
+SINGLEFLIGHT_IN_FLIGHT = Gauge(
+    "singleflight_in_flight",
+    "Chain executions currently shared between requests.",
+    ["name"],
+)
+
+
+def default_key(input: Any, config: RunnableConfig) -> str:
+    """Key of a `ChatInput` request, ignoring its session id.
+
+    The question is normalized like retrieval cache keys are, and only the
+    `configurable` part of the config changes what the chain does.
+    """
+    if isinstance(input, dict):
+        input = {k: v for k, v in input.items() if k != "session_id"}
+        if isinstance(input.get("question"), str):
+            input["question"] = normalize_question(input["question"])
+    payload = json.dumps(
+        [input, config.get("configurable") or {}],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+# Callback events replayed to the subscribers of a shared execution, with
+# the ignore flag handlers use to opt out of them.
+_REPLAYED_EVENTS = {
+    "on_chain_start": "ignore_chain",
+    "on_chain_end": "ignore_chain",
+    "on_chain_error": "ignore_chain",
+    "on_chat_model_start": "ignore_chat_model",
+    "on_llm_start": "ignore_llm",
+    "on_llm_new_token": "ignore_llm",
+    "on_llm_end": "ignore_llm",
+    "on_llm_error": "ignore_llm",
+    "on_retriever_start": "ignore_retriever",
+    "on_retriever_end": "ignore_retriever",
+    "on_retriever_error": "ignore_retriever",
+    "on_tool_start": "ignore_agent",
+    "on_tool_end": "ignore_agent",
+    "on_tool_error": "ignore_agent",
+}
+
+
+class _Flight:
+    def __init__(self):
+        # Output chunks, as ("chunk", chunk), and callback events of the
+        # execution, as ("event", (name, args, kwargs)), in order.
+        self.log: List[Tuple[str, Any]] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def publish(self) -> None:
+        # Wake up every waiting subscriber and re-arm for the next chunk.
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class _Recorder(BaseCallbackHandler):
+    """Record the callback events of a shared execution into its flight."""
+
+    run_inline = True
+
+    def __init__(self, flight: _Flight):
+        self.flight = flight
+
+
+def _recorder_method(name: str) -> Callable:
+    def record(self: _Recorder, *args: Any, **kwargs: Any) -> None:
+        self.flight.log.append(("event", (name, args, kwargs)))
+        self.flight.publish()
+
+    return record
+
+
+for _name in _REPLAYED_EVENTS:
+    setattr(_Recorder, _name, _recorder_method(_name))
+
+
+class _Replay:
+    """Re-emit recorded events under one subscriber's run.
+
+    Every subscriber gets its own run ids, and the top-level runs of the
+    execution become children of the subscriber's run, so its callbacks,
+    tracer and `astream_events` see the execution as if it were its own.
+    Start events of a follower are flagged as replayed, so metrics and
+    traces skip the backlog it catches up on in one burst.
+    """
+
+    def __init__(self, run_manager, follower: bool = False):
+        child: AsyncCallbackManager = run_manager.get_child()
+        self.handlers = child.handlers
+        self.tags = child.inheritable_tags
+        self.metadata = child.inheritable_metadata
+        self.parent_run_id = run_manager.run_id
+        self.follower = follower
+        self.run_ids: Dict[uuid.UUID, uuid.UUID] = {}
+
+    async def emit(self, name: str, args: tuple, kwargs: Dict[str, Any]) -> None:
+        if not self.handlers:
+            return
+        kwargs = dict(kwargs)
+        run_id = kwargs.get("run_id")
+        if run_id is not None:
+            kwargs["run_id"] = self.run_ids.setdefault(run_id, uuid.uuid4())
+        parent = kwargs.get("parent_run_id")
+        kwargs["parent_run_id"] = (
+            self.parent_run_id if parent is None else self.run_ids.get(parent, parent)
+        )
+        if name.endswith("_start"):
+            kwargs["tags"] = self.tags + (kwargs.get("tags") or [])
+            kwargs["metadata"] = {**self.metadata, **(kwargs.get("metadata") or {})}
+            if self.follower:
+                kwargs["metadata"][REPLAYED] = True
+        await ahandle_event(
+            self.handlers, name, _REPLAYED_EVENTS[name], *args, **kwargs
+        )
+
+
+class SingleflightRunnable(Runnable[Input, Output]):
+    """Share one execution of a chain between identical concurrent requests.
+
+    The first request for a key (the leader) starts the chain in a task of
+    its own. Requests with the same key that arrive while it runs (followers)
+    subscribe to it instead of starting another execution. Every subscriber
+    receives all chunks from the start, so late followers replay what they
+    missed and then stream along. The execution is cancelled once its last
+    subscriber goes away, and forgotten as soon as it finishes, so nothing is
+    cached beyond the in-flight window.
+
+    The execution runs without the callbacks of any request. Its callback
+    events are recorded and replayed to each subscriber under its own run,
+    so followers get the model tokens in `astream_events` and callbacks as
+    the leader does, and the leader going away changes nothing for them.
+
+    Only the async methods, which LangServe uses, coalesce requests. The sync
+    methods call the chain directly.
+    """
+
+    def __init__(
+        self,
+        runnable: Runnable[Input, Output],
+        key: Callable[[Any, RunnableConfig], str] = default_key,
+        name: str = "default",
+    ):
+        self.runnable = runnable
+        self.key = key
+        self.flight_name = name
+        self._flights: Dict[str, _Flight] = {}
+        SINGLEFLIGHT_IN_FLIGHT.set_function(lambda: len(self._flights), name=name)
+
+    @property
+    def InputType(self) -> Type[Input]:
+        return self.runnable.InputType
+
+    @property
+    def OutputType(self) -> Type[Output]:
+        return self.runnable.OutputType
+
+    @property
+    def config_specs(self) -> List[ConfigurableFieldSpec]:
+        return self.runnable.config_specs
+
+    def invoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        return self.runnable.invoke(input, config, **kwargs)
+
+    def stream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Output]:
+        yield from self.runnable.stream(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Output:
+        chunks = [chunk async for chunk in self.astream(input, config, **kwargs)]
+        return aggregate_chunks(chunks)
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async def input_aiter() -> AsyncIterator[Input]:
+            yield input
+
+        async for chunk in self._atransform_stream_with_config(
+            input_aiter(), self._atransform, config, **kwargs
+        ):
+            yield chunk
+
+    async def _atransform(
+        self, input: AsyncIterator[Input], run_manager, config, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        async for final in input:
+            async for chunk in self._subscribe(final, config, run_manager, **kwargs):
+                yield chunk
+
+    async def _run(
+        self, key: str, flight: _Flight, input: Input, config: RunnableConfig, **kwargs
+    ) -> None:
+        # The task starts with a copy of the leader's context, whose config
+        # would otherwise be inherited by the execution.
+        var_child_runnable_config.set(None)
+        shared_config: RunnableConfig = {
+            "callbacks": [_Recorder(flight)],
+            "configurable": config.get("configurable") or {},
+        }
+        try:
+            async for chunk in self.runnable.astream(input, shared_config, **kwargs):
+                flight.log.append(("chunk", chunk))
+                flight.publish()
+        except BaseException as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.publish()
+
+    async def _subscribe(
+        self, input: Input, config: RunnableConfig, run_manager, **kwargs: Any
+    ) -> AsyncIterator[Output]:
+        key = self.key(input, config)
+        flight = self._flights.get(key)
+        follower = flight is not None
+        if not follower:
+            SINGLEFLIGHT_REQUESTS.inc(name=self.flight_name, role="leader")
+            flight = self._flights[key] = _Flight()
+            flight.task = asyncio.create_task(
+                self._run(key, flight, input, config, **kwargs)
+            )
+        else:
+            SINGLEFLIGHT_REQUESTS.inc(name=self.flight_name, role="follower")
+            logger.debug(f"Joined in-flight execution {key}")
+
+        flight.subscribers += 1
+        replay = _Replay(run_manager, follower)
+        position = 0
+        try:
+            while True:
+                changed = flight.changed
+                while position < len(flight.log):
+                    kind, item = flight.log[position]
+                    position += 1
+                    if kind == "chunk":
+                        yield item
+                    else:
+                        await replay.emit(*item)
+                if flight.done:
+                    break
+                await changed.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening anymore, stop the upstream generation.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()